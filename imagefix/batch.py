@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# numpy is an optional dependency, only the batch chooser needs it
+import numpy as np
+
+NAT = np.datetime64("NaT", "us")
+ONE_MINUTE = np.timedelta64(60, "s")
+
+
+def dates_to_columns(dates_list, keys):
+    """Turn a list of ``{key: datetime}`` dicts into one datetime64[us] column per key."""
+    return {
+        key: np.array([dates.get(key) or NAT for dates in dates_list], dtype="datetime64[us]")
+        for key in keys
+    }
+
+
+def choose_batch(columns, order, min_date, max_date):
+    """Vectorized ImageDateChooser.choose over candidate columns.
+
+    Returns the chosen dates (NaT when none) and the index in ``order`` of
+    their source (-1 when none).
+    """
+    columns = {key: np.asarray(col).astype("datetime64[us]") for key, col in columns.items()}
+    size = len(next(iter(columns.values()))) if columns else 0
+    min_date = np.datetime64(min_date, "us")
+    max_date = np.datetime64(max_date, "us")
+
+    # NaT compares False, missing dates are never valid
+    valid = {key: (col > min_date) & (col < max_date) for key, col in columns.items()}
+    only_one = np.zeros(size, dtype=np.int64)
+    for mask in valid.values():
+        only_one += mask
+    only_one = only_one == 1
+
+    chosen = np.full(size, NAT, dtype="datetime64[us]")
+    source = np.full(size, -1, dtype=np.int8)
+    undecided = np.ones(size, dtype=bool)
+    for i, key in enumerate(order):
+        if key not in columns:
+            continue
+        col = columns[key]
+        # same rule as has_seconds: any hour or minute in the time of day
+        has_seconds = (col - col.astype("datetime64[D]")) >= ONE_MINUTE
+        take = undecided & valid[key] & (only_one | has_seconds)
+        chosen[take] = col[take]
+        source[take] = i
+        undecided &= ~take
+    return chosen, source
+
+
+def timestamps_to_column(timestamps):
+    """Turn naive epoch seconds, NaN when missing, into a datetime64[us] column."""
+    timestamps = np.asarray(timestamps, dtype=float)
+    missing = np.isnan(timestamps)
+    timestamps = np.where(missing, 0.0, timestamps)
+    # whole seconds apart from the fraction, rounded like timedelta(seconds=...) does
+    seconds = np.trunc(timestamps)
+    fraction = np.round((timestamps - seconds) * 1e6).astype(np.int64)
+    column = (seconds.astype(np.int64) * 1000000 + fraction).view("datetime64[us]")
+    column[missing] = NAT
+    return column
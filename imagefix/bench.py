@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import piexif
+from PIL import Image
+
+from . import exif
+from . import imagefix as imagefix_module
+from .imagefix import DateFromExifTag, ImageProcessor, ImgObject
+from .stats import Stats
+
+STAGES = ("walk", "exif", "parse", "find", "choose", "lazy", "write", "run")
+STARTUP_TARGET = 0.1
+
+MALFORMED_DATES = [
+    b"0000:00:00 00:00:00",
+    b"    :  :     :  :  ",
+    b"2019:13:45 25:61:61",
+    b"garbage",
+    b"",
+]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="imagefix.bench", description="Benchmark imagefix on a synthetic corpus"
+    )
+    parser.add_argument("-f", "--files", type=int, default=2000, help="number of images")
+    parser.add_argument("-s", "--seed", type=int, default=1, help="corpus random seed")
+    parser.add_argument("--depth", type=int, default=4, help="maximum folder depth")
+    parser.add_argument(
+        "--sizes",
+        default="64k,512k,4m",
+        help="comma separated file sizes the images are padded to",
+    )
+    parser.add_argument("--exif", type=float, default=0.9, help="ratio of files with EXIF")
+    parser.add_argument("--gps", type=float, default=0.3, help="ratio of files with GPS tags")
+    parser.add_argument(
+        "--malformed", type=float, default=0.05, help="ratio of files with malformed dates"
+    )
+    parser.add_argument("-w", "--workers", type=int, default=1, help="workers for the run stage")
+    parser.add_argument("--prefetch", type=int, default=0, help="prefetch depth for the run stage")
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="milliseconds added to every file open, to emulate a network mount",
+    )
+    parser.add_argument("-o", "--output", help="save the results as JSON")
+    parser.add_argument("-c", "--compare", help="compare with the results of a previous run")
+    parser.add_argument("--keep", help="generate the corpus in this directory and keep it")
+    parser.add_argument(
+        "--startup",
+        type=int,
+        metavar="RUNS",
+        help="only time the interpreter and import startup, best of RUNS",
+    )
+    opts = parser.parse_args(args)
+    if opts.startup:
+        print_startup(startup_times(opts.startup))
+        return
+
+    spec = {
+        "files": opts.files,
+        "seed": opts.seed,
+        "depth": opts.depth,
+        "sizes": [parse_size(s) for s in opts.sizes.split(",")],
+        "exif": opts.exif,
+        "gps": opts.gps,
+        "malformed": opts.malformed,
+    }
+    base_dir = opts.keep or tempfile.mkdtemp(prefix="imagefix-bench-")
+    try:
+        with injected_latency(opts.latency / 1000.0):
+            results = run_benchmark(
+                spec, Path(base_dir), workers=opts.workers, prefetch=opts.prefetch
+            )
+    finally:
+        if not opts.keep:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    print_results(results)
+    if opts.compare:
+        with open(opts.compare) as f:
+            print_comparison(json.load(f), results)
+    if opts.output:
+        with open(opts.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+class injected_latency:
+    # every open() made by the reader and the processor sleeps first
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def slow_open(self, *args, **kwargs):
+        time.sleep(self.seconds)
+        return open(*args, **kwargs)
+
+    def __enter__(self):
+        if self.seconds:
+            exif.open = imagefix_module.open = self.slow_open
+        return self
+
+    def __exit__(self, *exc_info):
+        for module in (exif, imagefix_module):
+            module.__dict__.pop("open", None)
+
+
+def parse_size(value):
+    value = value.strip().lower()
+    units = {"k": 1024, "m": 1024 * 1024}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def make_corpus(spec, root):
+    rnd = random.Random(spec["seed"])
+    base = base_jpeg()
+    start = datetime(2001, 1, 1)
+    folders = [root]
+    for i in range(spec["files"]):
+        # grow the tree as files are added, with the naming styles the path strategy knows
+        if rnd.random() < 0.1 or len(folders) == 1:
+            parent = rnd.choice(folders)
+            if len(parent.relative_to(root).parts) < spec["depth"]:
+                day = start + timedelta(days=rnd.randrange(8000))
+                style = rnd.randrange(3)
+                if style == 0:
+                    name = day.strftime("%Y-%m-%d") + " event {}".format(i)
+                elif style == 1:
+                    name = day.strftime("%Y") + " album {}".format(i)
+                else:
+                    name = "folder {}".format(i)
+                folders.append(parent.joinpath(name))
+        folder = rnd.choice(folders)
+        folder.mkdir(parents=True, exist_ok=True)
+
+        exif_dict = None
+        if rnd.random() < spec["exif"]:
+            taken = start + timedelta(seconds=rnd.randrange(8000 * 86400))
+            value = taken.strftime("%Y:%m:%d %H:%M:%S").encode()
+            if rnd.random() < spec["malformed"]:
+                value = rnd.choice(MALFORMED_DATES)
+            exif_dict = {
+                "0th": {piexif.ImageIFD.DateTime: value, piexif.ImageIFD.Make: b"bench"},
+                "Exif": {
+                    piexif.ExifIFD.DateTimeOriginal: value,
+                    piexif.ExifIFD.DateTimeDigitized: value,
+                },
+                "GPS": {},
+            }
+            if rnd.random() < spec["gps"]:
+                exif_dict["GPS"] = {
+                    piexif.GPSIFD.GPSDateStamp: taken.strftime("%Y:%m:%d").encode(),
+                    piexif.GPSIFD.GPSTimeStamp: (
+                        (taken.hour, 1),
+                        (taken.minute, 1),
+                        (taken.second, 1),
+                    ),
+                }
+        data = build_jpeg(base, exif_dict, rnd.choice(spec["sizes"]))
+        folder.joinpath("IMG_{:06d}.jpg".format(i)).write_bytes(data)
+
+
+def base_jpeg():
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 48), (90, 120, 30)).save(buf, "jpeg")
+    return buf.getvalue()
+
+
+def build_jpeg(base, exif_dict, size):
+    app1 = b""
+    if exif_dict is not None:
+        payload = piexif.dump(exif_dict)
+        app1 = b"\xff\xe1" + (len(payload) + 2).to_bytes(2, "big") + payload
+    data = base[:2] + app1 + base[2:]
+    # pad after EOI, readers never get there but the file has a realistic size
+    return data + b"\x00" * max(0, size - len(data))
+
+
+def run_benchmark(spec, base_dir, workers=1, prefetch=0):
+    corpus = base_dir.joinpath("corpus")
+    shutil.rmtree(corpus, ignore_errors=True)
+    make_corpus(spec, corpus)
+
+    processor = ImageProcessor(corpus)
+    finder, chooser, saver = processor.date_finder, processor.date_chooser, processor.date_saver
+    exif_strategy = next(s for s in finder.strategies if isinstance(s, DateFromExifTag))
+    timings = {}
+
+    t0 = time.perf_counter()
+    entries = list(processor.iter_files(corpus))
+    timings["walk"] = time.perf_counter() - t0
+
+    img_objs = [ImgObject(entry) for entry in entries]
+    t0 = time.perf_counter()
+    for img_obj in img_objs:
+        img_obj.exif_dict = exif_strategy.load_exif(img_obj.file_obj)
+    timings["exif"] = time.perf_counter() - t0
+
+    raw_dates = []
+    for img_obj in img_objs:
+        for _, etype, key in DateFromExifTag.DATES_TAGS:
+            raw_dates.append(exif_strategy.read_exif_tag(img_obj.exif_dict, etype, key))
+    t0 = time.perf_counter()
+    for value in raw_dates:
+        exif_strategy._convert_to_timestamp(value)
+    timings["parse"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for img_obj in img_objs:
+        finder.get_dates(img_obj)
+    timings["find"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for img_obj in img_objs:
+        img_obj.choosen = chooser.choose(img_obj)
+    timings["choose"] = time.perf_counter() - t0
+
+    # find and choose again, running only the strategies the choice needs
+    lazy_objs = []
+    for img_obj in img_objs:
+        lazy_obj = ImgObject(img_obj.file_obj, stat=img_obj.stat)
+        lazy_obj.exif_dict = img_obj.exif_dict
+        lazy_objs.append(lazy_obj)
+    t0 = time.perf_counter()
+    for lazy_obj in lazy_objs:
+        chooser.choose_lazy(lazy_obj, finder)
+    timings["lazy"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for img_obj in img_objs:
+        if img_obj.choosen:
+            saver.write(img_obj)
+    timings["write"] = time.perf_counter() - t0
+
+    # end to end on a fresh copy of the corpus
+    shutil.rmtree(corpus)
+    make_corpus(spec, corpus)
+    profile = {}
+    stats = Stats()
+    stats.add_callback(profile.update)
+    processor = ImageProcessor(corpus, workers=workers, stats=stats, prefetch=prefetch)
+    t0 = time.perf_counter()
+    processor.run()
+    timings["run"] = time.perf_counter() - t0
+
+    files = len(entries)
+    return {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "workers": workers,
+            "prefetch": prefetch,
+            "spec": spec,
+        },
+        "files": files,
+        "dates": len(raw_dates),
+        "stages": {
+            name: {
+                "seconds": seconds,
+                "files_per_sec": (
+                    (len(raw_dates) if name == "parse" else files) / seconds if seconds else None
+                ),
+            }
+            for name, seconds in timings.items()
+        },
+        "profile": profile,
+    }
+
+
+def startup_times(runs):
+    """Best wall time of fresh interpreters: bare, importing imagefix and ``imagefix --help``."""
+    commands = {
+        "python": [sys.executable, "-c", "pass"],
+        "import": [sys.executable, "-c", "import imagefix.imagefix"],
+        "help": [sys.executable, "-m", "imagefix", "--help"],
+    }
+    times = {}
+    for name, command in commands.items():
+        best = None
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        times[name] = best
+    return times
+
+
+def print_startup(times):
+    for name, seconds in times.items():
+        print("{:<8} {:>8.1f} ms".format(name, seconds * 1000))
+    verdict = "ok" if times["help"] < STARTUP_TARGET else "over"
+    print("help target {:.0f} ms: {}".format(STARTUP_TARGET * 1000, verdict))
+
+
+def print_results(results):
+    print("{} files, {} EXIF dates".format(results["files"], results["dates"]))
+    for name in STAGES:
+        stage = results["stages"][name]
+        print(
+            "{:<8} {:>10.4f} s {:>14.1f} items/s".format(
+                name, stage["seconds"], stage["files_per_sec"] or 0
+            )
+        )
+
+
+def print_comparison(old, new):
+    print("compared with {}".format(old["meta"]["date"]))
+    for name in STAGES:
+        if name in old["stages"] and name in new["stages"]:
+            before = old["stages"][name]["seconds"]
+            after = new["stages"][name]["seconds"]
+            print(
+                "{:<8} {:>10.4f} s -> {:>10.4f} s  x{:.2f}".format(
+                    name, before, after, before / after if after else 0
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
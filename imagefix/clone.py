@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import errno
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    # not on Windows, no reflinks there
+    fcntl = None
+
+# _IOW(0x94, 9, int) from linux/fs.h
+FICLONE = 0x40049409
+COPY_BLOCK = 1024 * 1024
+
+# the file system or the kernel cannot do it, try the next method
+FALLBACK_ERRNOS = {
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTTY,
+    errno.ENOTSOCK,
+    errno.EOPNOTSUPP,
+    errno.EPERM,
+}
+
+# (method, source device, destination device) known not to work
+_unsupported = set()
+
+
+def clone_file(src, dst):
+    """Copy ``src`` to ``dst`` with its times and mode, without going through Python buffers.
+
+    Tries a reflink, then ``copy_file_range``, then ``sendfile``. Returns the method used.
+    """
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        # opening it for writing would empty the source
+        raise shutil.SameFileError("{} and {} are the same file".format(src, dst))
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        if reflink(fsrc.fileno(), fdst.fileno()):
+            method = "reflink"
+        else:
+            method = copy_range(fsrc.fileno(), fdst.fileno(), 0, os.fstat(fsrc.fileno()).st_size)
+    shutil.copystat(src, dst)
+    return method
+
+
+def reflink(src_fd, dst_fd):
+    if fcntl is None:
+        return False
+    key = ("reflink", os.fstat(src_fd).st_dev, os.fstat(dst_fd).st_dev)
+    if key in _unsupported:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError as e:
+        if e.errno not in FALLBACK_ERRNOS:
+            raise
+        _unsupported.add(key)
+        return False
+    return True
+
+
+def copy_range(src_fd, dst_fd, offset, count):
+    """Write ``count`` bytes of ``src_fd`` from ``offset`` at the position of ``dst_fd``."""
+    devices = (os.fstat(src_fd).st_dev, os.fstat(dst_fd).st_dev)
+    for method, copy in (("copy_file_range", _copy_file_range), ("sendfile", _sendfile)):
+        if copy is None or (method,) + devices in _unsupported:
+            continue
+        try:
+            while count > 0:
+                n = copy(src_fd, dst_fd, offset, count)
+                if n == 0:
+                    break
+                offset += n
+                count -= n
+            return method
+        except OSError as e:
+            # carry on from where it stopped with the next method
+            if e.errno not in FALLBACK_ERRNOS:
+                raise
+            _unsupported.add((method,) + devices)
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    while count > 0:
+        data = os.read(src_fd, min(count, COPY_BLOCK))
+        if not data:
+            break
+        os.write(dst_fd, data)
+        count -= len(data)
+    return "copy"
+
+
+def _copy_file_range(src_fd, dst_fd, offset, count):
+    return os.copy_file_range(src_fd, dst_fd, count, offset)
+
+
+def _sendfile(src_fd, dst_fd, offset, count):
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+if not hasattr(os, "copy_file_range"):
+    _copy_file_range = None
+if not hasattr(os, "sendfile"):
+    _sendfile = None
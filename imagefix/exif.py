@@ -0,0 +1,506 @@
+# -*- coding: utf-8 -*-
+import functools
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from datetime import datetime
+
+from . import clone
+
+# TIFF/EXIF tag ids we care about
+DATE_TIME = 0x0132
+EXIF_IFD_POINTER = 0x8769
+GPS_IFD_POINTER = 0x8825
+DATE_TIME_ORIGINAL = 0x9003
+DATE_TIME_DIGITIZED = 0x9004
+USER_COMMENT = 0x9286
+GPS_TIME_STAMP = 0x0007
+GPS_DATE_STAMP = 0x001D
+
+WANTED_TAGS = {
+    "0th": (DATE_TIME,),
+    "Exif": (DATE_TIME_ORIGINAL, DATE_TIME_DIGITIZED, USER_COMMENT),
+    "GPS": (GPS_TIME_STAMP, GPS_DATE_STAMP),
+}
+
+# tags the saver may rewrite
+WRITABLE_TAGS = (
+    ("0th", DATE_TIME),
+    ("Exif", DATE_TIME_ORIGINAL),
+    ("Exif", DATE_TIME_DIGITIZED),
+    ("Exif", USER_COMMENT),
+)
+
+# UserComment values start with an 8 byte character code
+ASCII_COMMENT = b"ASCII\x00\x00\x00"
+
+# TIFF field type -> size in bytes of one value
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+
+EXIF_HEADER = b"Exif\x00\x00"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+TIFF_MAGICS = (b"II*\x00", b"MM\x00*")
+# VP8X flag telling the file has an EXIF chunk
+WEBP_EXIF_FLAG = 0x08
+
+# the containers find_exif knows, RAW files are TIFF with vendor IFDs
+EXTENSIONS = (
+    ".jpg",
+    ".jpeg",
+    ".tif",
+    ".tiff",
+    ".cr2",
+    ".nef",
+    ".arw",
+    ".dng",
+    ".png",
+    ".webp",
+)
+
+# fixed width EXIF dates: mapping every digit to 0 and every accepted separator
+# (: / \ -) to a colon must give one of these shapes
+_SHAPE_TABLE = bytearray(range(256))
+for _c in b"0123456789":
+    _SHAPE_TABLE[_c] = ord("0")
+for _c in b":/\\-":
+    _SHAPE_TABLE[_c] = ord(":")
+_SHAPE_TABLE = bytes(_SHAPE_TABLE)
+DATETIME_SHAPE = b"0000:00:00 00:00:00"
+DATE_SHAPE = b"0000:00:00"
+
+
+class ExifError(ValueError):
+    pass
+
+
+class UnknownFormatError(ExifError):
+    pass
+
+
+class TruncatedError(ExifError):
+    pass
+
+
+def read_exif(path):
+    """Read the date related EXIF tags of ``path`` without decoding the image.
+
+    Returns a piexif like dict (``{"0th": {...}, "Exif": {...}, "GPS": {...}}``)
+    or None when the file has no EXIF block.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise UnknownFormatError("empty file")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                return parse_exif(view)
+            finally:
+                view.release()
+
+
+def parse_exif(buf, partial=False):
+    # partial: buf is only the head of the file, running out of it is not the end of the file
+    location = find_exif(buf, partial=partial)
+    if location is None:
+        return None
+    start, end = location
+    with buf[start:end] as tiff:
+        try:
+            return parse_tiff(tiff)
+        except ExifError:
+            if partial and end == len(buf):
+                # a TIFF container goes on past the head of the file
+                raise TruncatedError("EXIF block past the end of the buffer")
+            raise
+
+
+def find_exif(buf, partial=False):
+    """Return the bounds of the TIFF block holding the EXIF tags, whatever the container.
+
+    Only markers, chunk headers and IFDs are read, never the image data.
+    """
+    head = bytes(buf[:12])
+    if head[:2] == b"\xff\xd8":
+        return find_jpeg_exif(buf, partial=partial)
+    if head[:4] in TIFF_MAGICS:
+        return 0, len(buf)
+    if head[:8] == PNG_SIGNATURE:
+        return find_png_exif(buf, partial=partial)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return find_webp_exif(buf, partial=partial)
+    raise UnknownFormatError("unknown image format")
+
+
+def find_jpeg_exif(buf, partial=False):
+    """Walk the JPEG markers until the APP1/Exif segment, return its TIFF bounds."""
+    size = len(buf)
+    if size < 4 or buf[0] != 0xFF or buf[1] != 0xD8:
+        raise UnknownFormatError("not a JPEG file")
+    pos = 2
+    while pos + 4 <= size:
+        if buf[pos] != 0xFF:
+            raise ExifError("invalid JPEG marker at offset {}".format(pos))
+        marker = buf[pos + 1]
+        if marker == 0xFF:
+            # fill byte
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # standalone markers, no length
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            # EOI or start of scan, no EXIF before the image data
+            return None
+        length = (buf[pos + 2] << 8) | buf[pos + 3]
+        if length < 2:
+            raise ExifError("invalid JPEG segment length at offset {}".format(pos))
+        end = pos + 2 + length
+        if marker == 0xE1 and buf[pos + 4 : pos + 10] == EXIF_HEADER:
+            if end > size:
+                raise TruncatedError("truncated APP1 segment")
+            return pos + 10, end
+        pos = end
+    if partial:
+        raise TruncatedError("no start of scan in the buffer")
+    return None
+
+
+def find_png_exif(buf, partial=False):
+    chunk = find_png_chunk(buf, b"eXIf", partial=partial)
+    if chunk is None:
+        return None
+    pos, length = chunk
+    return skip_exif_header(buf, pos + 8, pos + 8 + length)
+
+
+def find_png_chunk(buf, kind, partial=False):
+    """Return the position and the data length of the first ``kind`` chunk before IDAT."""
+    size = len(buf)
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= size:
+        length, chunk_kind = struct.unpack_from(">I4s", buf, pos)
+        if chunk_kind == kind:
+            if pos + 12 + length > size:
+                raise TruncatedError("truncated PNG chunk")
+            return pos, length
+        if chunk_kind in (b"IDAT", b"IEND"):
+            # metadata comes before the image data, do not walk the IDAT chunks
+            return None
+        pos += 12 + length
+    if partial:
+        raise TruncatedError("no image data in the buffer")
+    return None
+
+
+def find_webp_exif(buf, partial=False):
+    size = len(buf)
+    pos = 12
+    while pos + 8 <= size:
+        kind, length = struct.unpack_from("<4sI", buf, pos)
+        start, end = pos + 8, pos + 8 + length
+        if kind == b"EXIF":
+            if end > size:
+                raise TruncatedError("truncated WebP chunk")
+            return skip_exif_header(buf, start, end)
+        if pos == 12 and kind in (b"VP8 ", b"VP8L"):
+            # simple format, no room for metadata
+            return None
+        if kind == b"VP8X" and start < size and not buf[start] & WEBP_EXIF_FLAG:
+            return None
+        # chunks are padded to an even size
+        pos = end + (length & 1)
+    if partial:
+        raise TruncatedError("no EXIF chunk in the buffer")
+    return None
+
+
+def skip_exif_header(buf, start, end):
+    # some writers keep the APP1 "Exif\0\0" prefix in the chunk
+    if buf[start : start + len(EXIF_HEADER)] == EXIF_HEADER:
+        start += len(EXIF_HEADER)
+    return start, end
+
+
+def parse_tiff(tiff):
+    endian, ifds = read_entries(tiff)
+    exif_dict = {}
+    for ifd_name, tags in WANTED_TAGS.items():
+        exif_dict[ifd_name] = {}
+        read_values(tiff, endian, ifds.get(ifd_name, {}), tags, exif_dict[ifd_name])
+    return exif_dict
+
+
+def read_entries(tiff):
+    """Return the byte order and the raw entries of IFD0 and the Exif/GPS IFDs."""
+    order = bytes(tiff[:2])
+    if order == b"II":
+        endian = "<"
+    elif order == b"MM":
+        endian = ">"
+    else:
+        raise ExifError("invalid TIFF byte order")
+    if len(tiff) < 8:
+        raise ExifError("truncated TIFF header")
+    magic, ifd0 = struct.unpack_from(endian + "HI", tiff, 2)
+    if magic != 42:
+        raise ExifError("invalid TIFF magic number")
+
+    ifds = {"0th": read_ifd(tiff, endian, ifd0)}
+    for ifd_name, pointer in (("Exif", EXIF_IFD_POINTER), ("GPS", GPS_IFD_POINTER)):
+        if pointer in ifds["0th"]:
+            _, _, offset = ifds["0th"][pointer]
+            (sub_ifd,) = struct.unpack_from(endian + "I", tiff, offset)
+            ifds[ifd_name] = read_ifd(tiff, endian, sub_ifd)
+    return endian, ifds
+
+
+def read_ifd(tiff, endian, offset):
+    """Return ``{tag: (type, count, value offset)}`` for every entry of the IFD."""
+    size = len(tiff)
+    if offset + 2 > size:
+        raise ExifError("IFD offset out of bounds")
+    (count,) = struct.unpack_from(endian + "H", tiff, offset)
+    if offset + 2 + count * 12 > size:
+        raise ExifError("truncated IFD")
+    entries = {}
+    entry_fmt = endian + "HHI"
+    for pos in range(offset + 2, offset + 2 + count * 12, 12):
+        tag, typ, n = struct.unpack_from(entry_fmt, tiff, pos)
+        if typ not in TYPE_SIZES:
+            continue
+        if TYPE_SIZES[typ] * n > 4:
+            (value_offset,) = struct.unpack_from(endian + "I", tiff, pos + 8)
+        else:
+            value_offset = pos + 8
+        entries[tag] = (typ, n, value_offset)
+    return entries
+
+
+def read_values(tiff, endian, entries, tags, out):
+    for tag in tags:
+        if tag in entries:
+            out[tag] = read_value(tiff, endian, *entries[tag])
+
+
+def read_value(tiff, endian, typ, count, offset):
+    end = offset + TYPE_SIZES[typ] * count
+    if end > len(tiff):
+        raise ExifError("tag value out of bounds")
+    if typ == 2:
+        # same as piexif: drop the trailing NUL
+        return bytes(tiff[offset : end - 1])
+    if typ in (5, 10):
+        fmt = endian + ("II" if typ == 5 else "ii") * count
+        values = struct.unpack_from(fmt, tiff, offset)
+        pairs = tuple(zip(values[::2], values[1::2]))
+        return pairs[0] if count == 1 else pairs
+    if typ in (3, 4, 8, 9):
+        fmt = endian + {3: "H", 4: "I", 8: "h", 9: "i"}[typ] * count
+        values = struct.unpack_from(fmt, tiff, offset)
+        return values[0] if count == 1 else values
+    return bytes(tiff[offset:end])
+
+
+def write_tags(path, values):
+    """Write ``{(ifd name, tag): bytes}`` into the EXIF block of ``path``.
+
+    Values that fit the existing entries are patched in place through mmap,
+    anything else rewrites only the APP1 segment. Other containers cannot take
+    new entries, only the values that fit are patched and "partial" is returned,
+    or "unwritable" when none could be.
+    Image data is never touched.
+    Returns "unchanged", "patched", "spliced", "partial" or "unwritable".
+    """
+    tmp_name = None
+    with open(path, "r+b") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise UnknownFormatError("empty file")
+        with mmap.mmap(f.fileno(), 0) as mm:
+            view = memoryview(mm)
+            try:
+                result, patches, splice = plan_write(view, values)
+                if patches:
+                    for offset, data in patches:
+                        view[offset : offset + len(data)] = data
+                    mm.flush()
+                if splice:
+                    tmp_name = write_temp(path, *splice)
+            finally:
+                view.release()
+    if tmp_name:
+        os.replace(tmp_name, path)
+    return result
+
+
+def patch_bytes(data, values):
+    """Same as write_tags for an image held in memory, returns ``(result, new bytes)``."""
+    if not len(data):
+        raise UnknownFormatError("empty file")
+    with memoryview(data) as view:
+        result, patches, splice = plan_write(view, values)
+        if splice:
+            start, end, segment = splice
+            return result, b"".join((view[:start], segment, view[end:]))
+        new_data = bytearray(view)
+    for offset, chunk in patches:
+        new_data[offset : offset + len(chunk)] = chunk
+    return result, bytes(new_data)
+
+
+def plan_write(buf, values):
+    """Return ``(result, patches, splice)`` for ``values``, without writing anything.
+
+    ``splice`` is None or the ``(start, end, segment)`` APP1 replacement.
+    """
+    patches = plan_patches(buf, values)
+    if patches is not None:
+        return ("patched" if patches else "unchanged"), patches, None
+    if bytes(buf[:2]) != b"\xff\xd8":
+        # only JPEG can take new entries, patch those that already exist
+        fitting = {k: v for k, v in values.items() if plan_patches(buf, {k: v})}
+        patches = plan_patches(buf, fitting) if fitting else []
+        if not patches:
+            # no EXIF block, or none of the entries to change: not a byte is written
+            return "unwritable", [], None
+        return "partial", patches, None
+    return "spliced", None, plan_splice(buf, values)
+
+
+def plan_patches(buf, values):
+    """Return the ``(offset, bytes)`` patches for ``values``, or None if the IFDs must grow."""
+    location = find_exif(buf)
+    if location is None:
+        return None
+    start, end = location
+    with buf[start:end] as tiff:
+        _, ifds = read_entries(tiff)
+        patches = []
+        for (ifd_name, tag), value in values.items():
+            entry = ifds.get(ifd_name, {}).get(tag)
+            if entry is None:
+                return None
+            typ, count, offset = entry
+            # ASCII values are stored with their NUL terminator
+            data = value + b"\x00" if typ == 2 else value
+            if count != len(data):
+                return None
+            if tiff[offset : offset + count] != data:
+                patches.append((start + offset, data))
+    if patches and bytes(buf[:8]) == PNG_SIGNATURE:
+        patches.append(png_crc_patch(buf, patches))
+    return patches
+
+
+def png_crc_patch(buf, patches):
+    # the eXIf chunk CRC covers its type and data, recompute it with the patches applied
+    pos, length = find_png_chunk(buf, b"eXIf")
+    chunk = bytearray(buf[pos + 4 : pos + 8 + length])
+    for offset, data in patches:
+        chunk[offset - pos - 4 : offset - pos - 4 + len(data)] = data
+    return pos + 8 + length, struct.pack(">I", zlib.crc32(chunk))
+
+
+def plan_splice(buf, values):
+    """Return ``(start, end, segment)``, the APP1 segment of the JPEG ``buf`` with ``values``."""
+    # piexif is only needed when the IFD layout changes
+    import piexif
+
+    if bytes(buf[:2]) != b"\xff\xd8":
+        raise ExifError("new EXIF entries can only be added to JPEG files")
+    location = find_jpeg_exif(buf)
+    if location is None:
+        exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
+        seg_start = seg_end = app1_position(buf)
+    else:
+        start, end = location
+        exif_dict = piexif.load(bytes(buf[start - len(EXIF_HEADER) : end]))
+        seg_start, seg_end = start - len(EXIF_HEADER) - 4, end
+    for (ifd_name, tag), value in values.items():
+        exif_dict.setdefault(ifd_name, {})[tag] = value
+    payload = piexif.dump(exif_dict)
+    if len(payload) + 2 > 0xFFFF:
+        raise ExifError("EXIF block does not fit in one APP1 segment")
+    return seg_start, seg_end, b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
+
+
+def app1_position(buf):
+    # APP1 goes right after SOI, or after the JFIF APP0 segment when there is one
+    if buf[2] == 0xFF and buf[3] == 0xE0:
+        return 4 + ((buf[4] << 8) | buf[5])
+    return 2
+
+
+def write_temp(path, start, end, segment, tmp_name=None):
+    """Write a copy of ``path`` with ``segment`` in place of its ``start:end`` bytes.
+
+    The copy goes to ``tmp_name``, by default a new temporary file next to
+    ``path``, with its times and mode. The bytes around the segment are
+    copied by the kernel when it can.
+    """
+    if tmp_name is None:
+        directory, name = os.path.split(os.fspath(path))
+        fd, tmp_name = tempfile.mkstemp(prefix="." + name, suffix=".tmp", dir=directory or None)
+    else:
+        # a name planned by the journal, a copy left there by a crash is replaced
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+        fd = os.open(tmp_name, flags, 0o600)
+    try:
+        with open(path, "rb") as src, os.fdopen(fd, "wb") as f:
+            size = os.fstat(src.fileno()).st_size
+            clone.copy_range(src.fileno(), fd, 0, start)
+            f.write(segment)
+            f.flush()
+            clone.copy_range(src.fileno(), fd, end, size - end)
+        shutil.copystat(path, tmp_name)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+    return tmp_name
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_datetime(value):
+    """Parse an EXIF ``YYYY:MM:DD HH:MM:SS`` (or ``YYYY:MM:DD``) value, bytes or str.
+
+    Burst shots and the three date tags of a file usually share the value, hence the cache.
+    """
+    if not value:
+        return None
+    raw = value.encode("utf-8") if isinstance(value, str) else bytes(value)
+    shape = raw.translate(_SHAPE_TABLE)
+    try:
+        if shape == DATETIME_SHAPE:
+            return datetime(
+                int(raw[0:4]),
+                int(raw[5:7]),
+                int(raw[8:10]),
+                int(raw[11:13]),
+                int(raw[14:16]),
+                int(raw[17:19]),
+            )
+        if shape == DATE_SHAPE:
+            return datetime(int(raw[0:4]), int(raw[5:7]), int(raw[8:10]))
+    except ValueError:
+        # out of range fields, strptime rejects them too
+        return None
+    return _parse_datetime_slow(raw.decode("utf-8"))
+
+
+def _parse_datetime_slow(exif_val):
+    # anything not fixed width (padding, single digit fields, ...) goes through strptime
+    if exif_val and exif_val.strip(" \\/-"):
+        exif_val = exif_val.replace("/", ":")
+        exif_val = exif_val.replace("\\", ":")
+        exif_val = exif_val.replace("-", ":")
+        try:
+            return datetime.strptime(exif_val, "%Y:%m:%d %H:%M:%S")
+        except ValueError:
+            try:
+                return datetime.strptime(exif_val, "%Y:%m:%d")
+            except ValueError:
+                pass
+    return None
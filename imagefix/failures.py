@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import errno
+import json
+import os
+import struct
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+from . import exif
+
+UNKNOWN_FORMAT = "unknown-format"
+CORRUPT_IFD = "corrupt-ifd"
+IO_ERROR = "io-error"
+WRITE_FAILURE = "write-failure"
+UNEXPECTED = "unexpected"
+
+# the share or the disk may answer the next time
+TRANSIENT_ERRNOS = {
+    getattr(errno, name)
+    for name in (
+        "EIO",
+        "EAGAIN",
+        "EINTR",
+        "EBUSY",
+        "ETIMEDOUT",
+        "ESTALE",
+        "ECONNRESET",
+        "ECONNABORTED",
+        "EHOSTDOWN",
+        "EHOSTUNREACH",
+        "ENETDOWN",
+        "ENETRESET",
+        "ENETUNREACH",
+    )
+    if hasattr(errno, name)
+}
+
+Failure = namedtuple("Failure", "category error attempts")
+
+
+class WriteFailure(Exception):
+    """The file was read and dated, but the new dates could not be written."""
+
+    def __init__(self, cause):
+        super().__init__(str(cause))
+        self.cause = cause
+
+
+def categorize(error):
+    if isinstance(error, WriteFailure):
+        return WRITE_FAILURE
+    if isinstance(error, exif.UnknownFormatError):
+        return UNKNOWN_FORMAT
+    # piexif raises plain ValueError and struct.error on broken IFDs
+    if isinstance(error, (ValueError, struct.error)):
+        return CORRUPT_IFD
+    if isinstance(error, OSError):
+        return IO_ERROR
+    return UNEXPECTED
+
+
+def is_transient(error):
+    if isinstance(error, WriteFailure):
+        error = error.cause
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return isinstance(error, OSError) and error.errno in TRANSIENT_ERRNOS
+
+
+def describe(error, attempts=1):
+    cause = error.cause if isinstance(error, WriteFailure) else error
+    if isinstance(cause, str):
+        message = cause
+    else:
+        message = "{}: {}".format(type(cause).__name__, cause)
+    return Failure(categorize(error), message, attempts)
+
+
+def quarantine_path(report=None, main_dir=None, suffix=""):
+    """Next to the report when there is one, else in main_dir."""
+    if report:
+        report = Path(report)
+        return report.with_name(report.name.rsplit(".", 1)[0] + Quarantine.SUFFIX)
+    return Path(main_dir).joinpath(Quarantine.STEM + suffix + Quarantine.SUFFIX)
+
+
+def read_quarantine(path):
+    paths = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                paths.append(json.loads(line)["file_path"])
+    return paths
+
+
+class Quarantine:
+    """The files that failed in the last run, one JSON line each, for --retry-failed."""
+
+    STEM = ".imagefix"
+    SUFFIX = ".quarantine.jsonl"
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = Path(path)
+        self.count = 0
+        self.fp = None
+        # add may be called from any thread
+        self.lock = threading.Lock()
+
+    def add(self, file_obj, failure):
+        line = json.dumps(
+            {
+                "file_path": os.fspath(file_obj),
+                "category": failure.category,
+                "error": failure.error,
+                "attempts": failure.attempts,
+            },
+            ensure_ascii=False,
+        )
+        with self.lock:
+            if self.fp is None:
+                self.fp = open(self.path, "w", encoding="utf-8")
+            self.fp.write(line + "\n")
+            # a killed run still leaves the failures found so far
+            self.fp.flush()
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            if self.fp is not None:
+                self.fp.close()
+                self.fp = None
+            elif self.path.exists():
+                # nothing failed this time, the list of the previous run is stale
+                self.path.unlink()
@@ -1,34 +1,402 @@
-#!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import datetime
+import argparse
+import io
+import itertools
 import os
-import platform
 import re
+import signal
+import sys
+import threading
 import time
+import zlib
+from collections import OrderedDict, deque, namedtuple
+from datetime import datetime
 from pathlib import Path
 
-import piexif
-from PIL import Image
+from . import clone, exif, failures
+from .index import DateIndex
+from .journal import WriteJournal, journal_files, recover
+from .manifest import RunManifest
+from .metrics import Metrics, MetricsPublisher, NullMetrics
+from .record import FileRecord
+from .report import build_record, open_sink
+from .stats import NullStats, Stats
 
-main_dir = "D:\\Usuarios\\Peron\\Downloads\\COTE"
+IS_WINDOWS = sys.platform == "win32"
 
+NULL_STATS = NullStats()
+NULL_METRICS = NullMetrics()
+# the write results that changed bytes of the file
+WRITTEN_OUTCOMES = frozenset(("patched", "spliced", "partial"))
+# header of the files a prefetch thread found unchanged since the last run
+SKIPPED = object()
+# what a date_finder needs for ImageDateChooser.choose_lazy
+LAZY_FINDER_METHODS = ("start", "provide", "provide_cheapest", "finish")
 
-def main():
-    processor = ImageProcessor(Path(main_dir))
-    processor.run()
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="imagefix", description="Fix image taken dates")
+    parser.add_argument("main_dir", help="folder with the images to fix")
+    parser.add_argument(
+        "-d",
+        "--dest-dir",
+        help="write the fixed files to a mirror of main_dir there, cloned from the originals",
+    )
+    parser.add_argument(
+        "-e",
+        "--extensions",
+        type=parse_extensions,
+        help="comma separated file extensions to process (default: {})".format(
+            ",".join(ext.lstrip(".") for ext in exif.EXTENSIONS)
+        ),
+    )
+    parser.add_argument(
+        "-b",
+        "--backup",
+        action="store_true",
+        help="keep the original dates in the EXIF UserComment before changing them",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes (0 uses one per CPU)",
+    )
+    parser.add_argument(
+        "--no-manifest",
+        dest="manifest",
+        action="store_false",
+        help="do not record processed files, reprocess everything",
+    )
+    parser.add_argument(
+        "--index",
+        action="store_true",
+        help="keep the candidate dates of every file in main_dir for python -m imagefix.index, "
+        "which runs every date strategy on every file, read again once when not indexed yet",
+    )
+    parser.add_argument(
+        "--reset-manifest",
+        action="store_true",
+        help="forget the files recorded by previous runs",
+    )
+    parser.add_argument(
+        "-n", "--dry-run", action="store_true", help="choose dates but do not write them"
+    )
+    parser.add_argument(
+        "-r",
+        "--report",
+        help="write one record per file to a .jsonl, .csv or .db report, with every candidate "
+        "date, which runs every date strategy on every file",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every file")
+    parser.add_argument(
+        "--profile", action="store_true", help="print per stage timings at the end of the run"
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=0,
+        help="read the headers of up to N files ahead, for high latency mounts",
+    )
+    parser.add_argument(
+        "--prefetch-memory",
+        type=int,
+        default=64,
+        help="memory cap in MiB for the prefetched headers",
+    )
+    parser.add_argument(
+        "--no-journal",
+        dest="journal",
+        action="store_false",
+        help="write every file on its own, without the crash-safe journal",
+    )
+    parser.add_argument(
+        "--write-batch",
+        type=int,
+        default=256,
+        help="files written and synced together when journaling",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="finish the writes of an interrupted run, then continue it",
+    )
+    parser.add_argument(
+        "--rollback",
+        action="store_true",
+        help="restore the files changed by an interrupted run and exit",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=2,
+        help="tries again after a transient I/O error, waiting longer each time",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="process again only the files that failed in the last run",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        help="process only shard I of N (1-based), to split one tree between hosts",
+    )
+    parser.add_argument(
+        "--metrics-dir",
+        help="keep a Prometheus textfile of the run counters there, for node_exporter",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=15.0,
+        help="seconds between two writes of the metrics textfile",
+    )
+    parser.add_argument(
+        "--progress",
+        action="store_true",
+        help="show the files done, the throughput and the time left on stderr",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and fix new files as they are written into main_dir",
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=0.25,
+        help="seconds a watched file must stay unchanged before it is processed",
+    )
+    parser.add_argument(
+        "--poll",
+        type=float,
+        help="watch by listing changed directories every N seconds instead of inotify",
+    )
+    opts = parser.parse_args(args)
+    if opts.retry_failed and opts.watch:
+        parser.error("--retry-failed cannot be combined with --watch")
+    if opts.metrics_dir and not os.path.isdir(opts.metrics_dir):
+        parser.error("no directory {} for the metrics".format(opts.metrics_dir))
+    if opts.dest_dir and is_inside(opts.dest_dir, opts.main_dir):
+        parser.error(
+            "dest_dir {} is inside {}, the next runs would copy the copies".format(
+                opts.dest_dir, opts.main_dir
+            )
+        )
+    # every shard keeps its own manifest and journal, hosts never share them
+    suffix = shard_suffix(opts.shard)
+    journal_dir = Path(opts.main_dir).joinpath(WriteJournal.DIRNAME + suffix)
+    if opts.resume or opts.rollback:
+        for path in recover(journal_dir, rollback=opts.rollback):
+            print("Changed since it was journaled, left alone: {}".format(path))
+        if opts.rollback:
+            return
+    elif journal_files(journal_dir):
+        parser.error(
+            "an interrupted run left a journal in {}, use --resume or --rollback".format(
+                journal_dir
+            )
+        )
+    journal = None
+    if opts.journal and not opts.dry_run:
+        journal = WriteJournal(journal_dir, batch_size=opts.write_batch)
+    manifest = None
+    if opts.manifest:
+        manifest = RunManifest(
+            Path(opts.main_dir).joinpath(RunManifest.STEM + suffix + ".db"),
+            reset=opts.reset_manifest,
+        )
+    # the failures are listed next to the report, or in main_dir without one
+    quarantine_path = failures.quarantine_path(opts.report, opts.main_dir, suffix)
+    retry_paths = None
+    if opts.retry_failed:
+        if not quarantine_path.is_file():
+            parser.error("no failed files listed in {}".format(quarantine_path))
+        retry_paths = failures.read_quarantine(quarantine_path)
+    index = None
+    if opts.index:
+        index = DateIndex(Path(opts.main_dir).joinpath(DateIndex.STEM + suffix + ".db"))
+    report = open_sink(opts.report) if opts.report else None
+    metrics = Metrics() if opts.metrics_dir or opts.progress else None
+    processor = ImageProcessor(
+        Path(opts.main_dir),
+        workers=opts.workers,
+        manifest=manifest,
+        index=index,
+        dry_run=opts.dry_run,
+        report=report,
+        verbose=opts.verbose,
+        stats=Stats() if opts.profile else None,
+        prefetch=opts.prefetch,
+        prefetch_memory=opts.prefetch_memory * 1024 * 1024,
+        journal=journal,
+        dest_dir=Path(opts.dest_dir) if opts.dest_dir else None,
+        shard=opts.shard,
+        make_backup=opts.backup,
+        accept_extensions=opts.extensions,
+        quarantine=failures.Quarantine(quarantine_path),
+        retries=opts.retries,
+        metrics=metrics,
+    )
+    publisher = None
+    if metrics:
+        publisher = MetricsPublisher(
+            metrics,
+            path=(
+                Path(opts.metrics_dir).joinpath("imagefix{}.prom".format(suffix))
+                if opts.metrics_dir
+                else None
+            ),
+            progress=sys.stderr if opts.progress else None,
+            interval=opts.metrics_interval,
+        )
+        if opts.progress and not opts.watch:
+            if retry_paths is not None:
+                metrics.expected = len(retry_paths)
+            else:
+                publisher.precount(lambda: processor.count_files(opts.main_dir))
+        publisher.start()
+    watcher = None
+    stop = threading.Event()
+    if opts.watch:
+        from .watch import open_watcher
+
+        watcher = open_watcher(opts.main_dir, settle=opts.settle, poll_interval=opts.poll)
+        # stop between two batches, never in the middle of a write
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda signum, frame: stop.set())
+    try:
+        processor.run(watcher, stop, paths=retry_paths)
+    finally:
+        if watcher is not None:
+            watcher.close()
+        if publisher is not None:
+            publisher.close()
+    for file_obj, failure in processor.errors:
+        print("Error [{}]: {} -> {}".format(failure.category, file_obj, failure.error))
+    if processor.failed:
+        print(
+            "{} files failed, listed in {} for --retry-failed".format(
+                processor.failed, quarantine_path
+            )
+        )
+    return 1 if processor.failed else 0
+
+
+def parse_extensions(value):
+    return tuple("." + ext.strip().lower().lstrip(".") for ext in value.split(",") if ext.strip())
+
+
+def parse_shard(value):
+    try:
+        index, count = map(int, value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected I/N, got {}".format(value))
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError("shard {} is not between 1 and {}".format(index, count))
+    return index - 1, count
+
+
+def same_directory(a, b):
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        # one of them does not exist yet
+        return os.path.realpath(a) == os.path.realpath(b)
+
+
+def is_inside(path, directory):
+    path, directory = os.path.realpath(path), os.path.realpath(directory)
+    return path != directory and os.path.commonpath([path, directory]) == directory
+
+
+def shard_suffix(shard):
+    if shard is None:
+        return ""
+    return "-{}-of-{}".format(shard[0] + 1, shard[1])
+
+
+# worker side of the process pool, set once per worker by the pool initializer
+_worker_processor = None
+
+
+def _init_worker(processor):
+    global _worker_processor
+    _worker_processor = processor
+
+
+def _process_bytes(item):
+    return _worker_processor.try_process_bytes(item)
+
+
+def bytes_of(data):
+    if hasattr(data, "read"):
+        return data.read()
+    return bytes(data)
+
+
+def _process_chunk(entries):
+    processor = _worker_processor
+    # only the compact records and the failures go back to the parent
+    results = processor.process_batch(processor.prefetched(entries))
+    return results, processor.stats.drain(), processor.metrics.drain()
+
+
+class FileEntry:
+    # what the walker yields: the path and the stat scandir already made
+    __slots__ = ("path", "stat")
+
+    def __init__(self, path, stat):
+        self.path = path
+        self.stat = stat
+
+    def __fspath__(self):
+        return self.path
+
+    def __str__(self):
+        return self.path
+
+
+class MemoryStat:
+    # the parts of a stat the strategies and the records read, for images held in memory
+    __slots__ = ("st_size", "st_mtime", "st_ctime", "st_mtime_ns", "st_ino")
+
+    def __init__(self, size, mtime=None):
+        self.st_size = size
+        self.st_mtime = self.st_ctime = mtime
+        self.st_mtime_ns = int(mtime * 1e9) if mtime is not None else 0
+        self.st_ino = 0
+
+
+# the record of an image processed from memory, its patched bytes when asked for and,
+# from process_many, the failure of an image that could not be processed
+BytesResult = namedtuple("BytesResult", "record data failure")
 
 
 class ImgObject:
-    def __init__(self, file_obj, img=None, dates=None):
+    def __init__(self, file_obj, img=None, dates=None, stat=None):
         super().__init__()
+        if isinstance(file_obj, FileEntry):
+            stat = file_obj.stat
+            file_obj = file_obj.path
         if isinstance(file_obj, str):
-            self.file_obj = Path(file_obj)
+            file_obj = Path(file_obj)
         self.file_obj = file_obj
-        if img is None:
-            self.img = img
-        if dates is None:
-            self.dates = {}
+        self.stat = stat
+        # head of the file when it was prefetched
+        self.header = None
+        # the whole file when it is only in memory
+        self.data = None
+        self.img = img
+        self.exif_dict = None
+        self.dates = {} if dates is None else dates
         self.choosen = None
+        self.choosen_key = None
+        self.reason = None
+        # strategies not run yet while the chooser pulls the dates it needs
+        self.pending_strategies = None
 
 
 class ImageProcessor:
@@ -41,6 +409,23 @@ class ImageProcessor:
         date_saver=None,
         accept_extensions=None,
         dest_dir=None,
+        workers=1,
+        chunksize=None,
+        manifest=None,
+        dry_run=False,
+        report=None,
+        verbose=False,
+        stats=None,
+        prefetch=0,
+        prefetch_bytes=65536,
+        prefetch_memory=64 * 1024 * 1024,
+        journal=None,
+        shard=None,
+        index=None,
+        quarantine=None,
+        retries=2,
+        retry_delay=0.5,
+        metrics=None,
     ):
         super().__init__()
         self.main_dir = main_dir
@@ -60,57 +445,667 @@ class ImageProcessor:
         if accept_extensions:
             self.accept_extensions = accept_extensions
         else:
-            self.accept_extensions = (
-                ".jpg",
-                ".jpeg",
-            )
+            self.accept_extensions = exif.EXTENSIONS
         if dest_dir:
             self.dest_dir = dest_dir
         else:
             self.dest_dir = self.main_dir
+        self.workers = workers if workers else os.cpu_count()
+        self.chunksize = chunksize
+        self.manifest = manifest
+        self.dry_run = dry_run
+        self.report = report
+        self.verbose = verbose
+        self.stats = stats if stats else NullStats()
+        self.metrics = metrics if metrics else NULL_METRICS
+        self.prefetch = prefetch
+        self.prefetch_bytes = prefetch_bytes
+        self.prefetch_memory = prefetch_memory
+        self.journal = journal
+        self.index = index
+        self.quarantine = quarantine
+        self.retries = retries
+        self.retry_delay = retry_delay
+        # the report, the index and the backup list every candidate, not only the deciding ones
+        self.all_dates = bool(report or index or make_backup)
+        # (index, count), index from 0
+        self.shard = shard
+        self.processed = 0
+        self.changed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors = []
+        # (handler, args) of the walker while it feeds the pool from another thread
+        self.walker_events = None
 
-    def run(self):
+    def __getstate__(self):
+        # parent only resources are not sent to the pool workers
+        state = self.__dict__.copy()
+        state["manifest"] = None
+        state["index"] = None
+        state["quarantine"] = None
+        state["report"] = None
+        state["walker_events"] = None
+        if self.stats.enabled:
+            # workers collect into their own stats and send them back with each result
+            state["stats"] = Stats(max_samples=self.stats.max_samples)
+        return state
+
+    def run(self, watcher=None, stop=None, paths=None):
+        # paths, when given, are processed instead of the whole tree
         directory = Path(self.main_dir)
-        self.walk(directory)
+        if self.copying() and is_inside(self.dest_dir, directory):
+            raise ValueError("dest_dir {} is inside {}".format(self.dest_dir, directory))
+        if self.manifest:
+            self.manifest.check_config(self.config_key())
+        try:
+            if watcher is not None:
+                self.watch(directory, watcher, stop or threading.Event())
+            elif self.workers > 1:
+                self.run_parallel(directory, paths)
+            else:
+                self.walk(directory, paths)
+            if self.journal:
+                self.journal.finish()
+        finally:
+            if self.manifest:
+                self.manifest.close()
+            if self.index:
+                self.index.close()
+            if self.quarantine:
+                self.quarantine.close()
+            if self.report:
+                self.report.close()
+            if self.stats.enabled:
+                self.stats.report(sys.stdout)
 
-    def walk(self, directory):
-        for f in directory.iterdir():
-            if f.is_file():
-                if str(f).lower().endswith(self.accept_extensions):
-                    self.process(f)
+    def config_key(self):
+        # anything that changes the outcome for an unchanged file
+        return repr(
+            (
+                self.date_chooser.config_key(),
+                [getattr(s, "name", type(s).__name__) for s in self.date_finder.strategies],
+                self.make_backup,
+                # where the tree is mounted does not matter, only whether it is copied elsewhere
+                os.path.realpath(self.dest_dir) if self.copying() else None,
+            )
+        )
+
+    def iter_files(self, directory, stat=True):
+        # iterative, so deep trees do not hit the recursion limit, and only the
+        # pending directories of the current branch are kept in memory; without
+        # ``stat`` the entries have none and whoever stats them checks the manifest
+        stack = [os.fspath(directory)]
+        while stack:
+            subdirs = []
+            top = stack.pop()
+            try:
+                it = os.scandir(top)
+            except OSError as e:
+                # the rest of the tree is still walked
+                self.from_walker(self.handle_error, FileEntry(top, None), failures.describe(e))
+                continue
+            with it:
+                for entry in it:
+                    if entry.is_file():
+                        if entry.name.lower().endswith(self.accept_extensions):
+                            if self.shard and not self.in_shard(entry.path):
+                                continue
+                            self.metrics.incr("seen")
+                            if not stat:
+                                yield FileEntry(entry.path, None)
+                                continue
+                            file_entry = FileEntry(entry.path, entry.stat())
+                            if not self.is_done(file_entry):
+                                yield file_entry
+                    elif entry.is_dir():
+                        subdirs.append(entry.path)
+            stack.extend(reversed(subdirs))
+
+    def listed_files(self, paths):
+        for path in paths:
+            if os.path.isdir(path):
+                # a directory that could not be listed
+                yield from self.iter_files(path)
+                continue
+            try:
+                file_entry = FileEntry(path, os.stat(path))
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                self.from_walker(self.handle_error, FileEntry(path, None), failures.describe(e))
+                continue
+            self.metrics.incr("seen")
+            if not self.is_done(file_entry):
+                yield file_entry
+
+    def count_files(self, directory):
+        # the progress line only needs a total: no stat and no manifest lookup
+        count = 0
+        stack = [os.fspath(directory)]
+        while stack:
+            try:
+                it = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    if entry.is_file():
+                        if entry.name.lower().endswith(self.accept_extensions):
+                            if not self.shard or self.in_shard(entry.path):
+                                count += 1
+                    elif entry.is_dir():
+                        stack.append(entry.path)
+        return count
+
+    def manifest_key(self, file_obj):
+        return Path(file_obj).relative_to(self.main_dir).as_posix()
+
+    def in_shard(self, path):
+        # crc32 of the relative path is the same on every host and Python version
+        index, count = self.shard
+        return zlib.crc32(self.manifest_key(path).encode("utf-8")) % count == index
+
+    def is_done(self, file_entry):
+        if not self.is_current(file_entry):
+            return False
+        self.from_walker(self.count_skipped)
+        return True
+
+    def from_walker(self, handler, *args):
+        # the counters, the errors and the stats belong to the thread handling the results
+        if self.walker_events is None:
+            handler(*args)
+        else:
+            self.walker_events.append((handler, args))
+
+    def handle_walker_events(self):
+        events = self.walker_events
+        while events:
+            handler, args = events.popleft()
+            handler(*args)
+
+    def is_current(self, file_entry):
+        # the manifest and the index lock themselves, the prefetch threads check here too
+        if not self.manifest:
+            return False
+        key = self.manifest_key(file_entry)
+        if not self.manifest.is_current(key, file_entry.stat):
+            return False
+        # files done before the index was asked for are still indexed once
+        return not self.index or self.index.is_current(key, file_entry.stat)
+
+    def count_skipped(self):
+        self.skipped += 1
+        self.metrics.incr("skipped")
+
+    def walk(self, directory, paths=None):
+        stats = self.stats
+        if paths is None:
+            # with a prefetch the stats are made by its threads too
+            files = self.iter_files(directory, stat=not self.prefetch)
+        else:
+            files = self.listed_files(paths)
+        files = self.prefetched(self.timed_files(files))
+        batch_size = self.journal.batch_size if self.journal else 1
+        for batch in self.iter_chunks(files, batch_size):
+            for item, failure in self.process_batch(batch):
+                with stats.stage("record"):
+                    self.handle_outcome(item, failure)
+
+    def watch(self, directory, watcher, stop, batch_size=32):
+        # the files already there first, then only what the watcher reports
+        written = OrderedDict()
+        files = self.iter_files(directory)
+        while not stop.is_set():
+            for batch in self.iter_chunks(files, batch_size):
+                self.process_watched(batch, written)
+                if stop.is_set():
+                    return
+            if watcher.overflowed:
+                # events were lost, only a rescan can tell what changed
+                watcher.overflowed = False
+                files = self.iter_files(directory)
             else:
-                self.walk(f)
+                files = self.watched_entries(watcher.wait(0.5), written)
 
-    def process(self, file_obj):
-        img_obj = ImgObject(file_obj)
+    def watched_entries(self, paths, written):
+        for path in paths:
+            if not path.lower().endswith(self.accept_extensions):
+                continue
+            if self.shard and not self.in_shard(path):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            # our own writes come back as events
+            if written.get(path) == (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+                continue
+            self.metrics.incr("seen")
+            file_entry = FileEntry(path, stat)
+            if not self.is_done(file_entry):
+                yield file_entry
 
-        with Image.open(img_obj.file_obj) as img:
-            img_obj.img = img
-            img_obj.exif_dict = piexif.load(img.info["exif"])
-            # search dates
+    def process_watched(self, entries, written, max_written=100000):
+        chooser = self.date_chooser
+        if not getattr(chooser, "fixed_max_date", True):
+            # for a watch, the start of the run is the start of the batch
+            chooser.max_date = datetime.now()
+        for item, failure in self.process_batch((f, None) for f in entries):
+            self.handle_outcome(item, failure)
+            if failure is None:
+                written[item.path] = (item.size, item.mtime_ns, item.inode)
+                written.move_to_end(item.path)
+        # printed as they happen, a long watch does not keep them all
+        for file_obj, failure in self.errors:
+            print("Error [{}]: {} -> {}".format(failure.category, file_obj, failure.error))
+        self.errors = []
+        while len(written) > max_written:
+            written.popitem(last=False)
+        # a long running watch keeps its manifest and report current
+        if self.manifest:
+            self.manifest.commit()
+        if self.index:
+            self.index.commit()
+        if self.report:
+            self.report.flush()
+
+    def timed_files(self, files):
+        # the walker is a generator, time each step of it apart from the processing
+        if not self.stats.enabled:
+            return files
+        return self._timed_files(files)
+
+    def _timed_files(self, files):
+        files = iter(files)
+        while True:
+            start = time.perf_counter()
+            f = next(files, None)
+            if f is None:
+                return
+            self.from_walker(self.stats.add, "walk", time.perf_counter() - start)
+            yield f
+
+    def prefetched(self, files):
+        # yields (file, header): a thread pool reads the head of the next files while
+        # the current one is parsed, so several slow reads are in flight at once
+        if not self.prefetch:
+            for f in files:
+                yield f, None
+            return
+        depth = max(1, min(self.prefetch, self.prefetch_memory // self.prefetch_bytes))
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=depth, thread_name_prefix="prefetch") as executor:
+            pending = deque()
+            for f in files:
+                pending.append(executor.submit(self.read_header, f))
+                if len(pending) >= depth:
+                    yield from self.unless_skipped(pending.popleft().result())
+            while pending:
+                yield from self.unless_skipped(pending.popleft().result())
+
+    def unless_skipped(self, result):
+        # counted here, the counters belong to the thread running the files
+        if result[1] is SKIPPED:
+            self.count_skipped()
+        else:
+            yield result
+
+    def read_header(self, file_obj):
+        try:
+            if self.manifest and isinstance(file_obj, FileEntry) and file_obj.stat is None:
+                # not worth opening when the manifest has it unchanged
+                file_obj = FileEntry(file_obj.path, os.stat(file_obj.path))
+                if self.is_current(file_obj):
+                    return file_obj, SKIPPED
+            with open(file_obj, "rb") as f:
+                if not isinstance(file_obj, FileEntry) or file_obj.stat is None:
+                    file_obj = FileEntry(os.fspath(file_obj), os.fstat(f.fileno()))
+                return file_obj, f.read(self.prefetch_bytes)
+        except OSError:
+            # let the processing hit the error again and report it
+            return file_obj, None
+
+    def run_parallel(self, directory, paths=None):
+        # imap keeps the results in discovery order, whatever worker finishes first
+        chunksize = self.chunksize or 32
+        # imap drains its input as fast as it can, only let a few chunks per worker ahead
+        in_flight = threading.Semaphore(self.workers * 4)
+        stopped = threading.Event()
+        files = self.iter_files(directory) if paths is None else self.listed_files(paths)
+        files = self.timed_files(files)
+        chunks = self.iter_bounded(self.iter_chunks(files, chunksize), in_flight, stopped)
+        stats = self.stats
+        import multiprocessing
+
+        with multiprocessing.Pool(self.workers, initializer=_init_worker, initargs=(self,)) as pool:
+            # the walker runs in the thread feeding the pool, this one handles what it finds
+            self.walker_events = deque()
+            try:
+                for results, stats_data, metrics_data in pool.imap(_process_chunk, chunks):
+                    in_flight.release()
+                    self.handle_walker_events()
+                    if stats_data:
+                        stats.merge(stats_data)
+                    if metrics_data:
+                        self.metrics.merge(metrics_data)
+                    for item, failure in results:
+                        with stats.stage("record"):
+                            self.handle_outcome(item, failure)
+                # the feeder is done once the last chunk is back
+                self.handle_walker_events()
+            finally:
+                stopped.set()
+                self.walker_events = None
+
+    def iter_chunks(self, files, chunksize):
+        files = iter(files)
+        while True:
+            chunk = list(itertools.islice(files, chunksize))
+            if not chunk:
+                return
+            yield chunk
+
+    def iter_bounded(self, items, semaphore, stopped):
+        for item in items:
+            while not semaphore.acquire(timeout=0.5):
+                if stopped.is_set():
+                    return
+            yield item
+
+    def handle_outcome(self, item, failure):
+        # a record, or the file when it failed
+        if failure is None:
+            self.handle_result(item)
+        else:
+            self.handle_error(item, failure)
+
+    def handle_result(self, record):
+        self.processed += 1
+        self.metrics.incr("processed")
+        if record.outcome in WRITTEN_OUTCOMES:
+            self.changed += 1
+            self.metrics.incr("fixed")
+        if self.verbose:
+            print("File: {} -> Date: {} ({})".format(record.path, record.choosen, record.outcome))
+        if self.report:
+            self.report.write(build_record(record, ImageDateChooser.CHOOSE_ORDER))
+        if self.manifest and not self.dry_run:
+            self.manifest.record(self.manifest_key(record.path), record)
+        if self.index:
+            self.index.record(self.manifest_key(record.path), record)
+
+    def handle_error(self, file_obj, failure):
+        self.failed += 1
+        self.errors.append((file_obj, failure))
+        self.stats.incr("failed." + failure.category)
+        self.metrics.incr("failed", failure.category)
+        if self.quarantine:
+            self.quarantine.add(file_obj, failure)
+
+    def process_bytes(self, data, filename=None, folder=None, mtime=None, patch=False):
+        """Date an image held in memory, bytes, a memoryview or a binary file object.
+
+        ``filename`` and ``folder`` stand in for the path, ``mtime`` (a datetime or
+        a timestamp) for the file date. Returns a BytesResult, whose data is the
+        image with the chosen date written when ``patch`` is set.
+        """
+        if hasattr(data, "read"):
+            data = data.read()
+        if isinstance(mtime, datetime):
+            mtime = mtime.timestamp()
+        img_obj = ImgObject(
+            Path(folder or "").joinpath(filename or "upload"), stat=MemoryStat(len(data), mtime)
+        )
+        img_obj.data = data
+
+        stats = self.stats
+        # every candidate is returned, none is skipped
+        with stats.stage("find"):
             self.date_finder.get_dates(img_obj)
+        with stats.stage("choose"):
             img_obj.choosen = self.date_chooser.choose(img_obj)
-            if img_obj.choosen:
-                self.date_saver.write(img_obj)
+        new_data = None
+        if not img_obj.choosen:
+            outcome = "nodate"
+            new_data = data if patch else None
+        elif patch:
+            with stats.stage("write"):
+                try:
+                    outcome, new_data = self.date_saver.patch_bytes(img_obj)
+                except Exception as e:
+                    raise failures.WriteFailure(e) from e
+        else:
+            outcome = "dry-run"
+        record = FileRecord.from_img_obj(img_obj, img_obj.stat, outcome)
+        return BytesResult(record, new_data, None)
+
+    def process_many(self, items, patch=False):
+        """Yield a BytesResult per item, in order, with the worker pool when there is one.
+
+        An item is an image as process_bytes takes it, or a dict of its data and
+        keyword arguments. Failures are returned in the results, not raised.
+        """
+        items = (item if isinstance(item, dict) else {"data": item} for item in items)
+        if self.workers <= 1:
+            for item in items:
+                yield self.try_process_bytes(dict(item, patch=patch))
+            return
+        import multiprocessing
+
+        # memoryviews and files do not pickle, the workers get bytes
+        items = (dict(item, data=bytes_of(item["data"]), patch=patch) for item in items)
+        with multiprocessing.Pool(self.workers, initializer=_init_worker, initargs=(self,)) as pool:
+            yield from pool.imap(_process_bytes, items, self.chunksize or 8)
+
+    def try_process_bytes(self, item):
+        try:
+            return self.process_bytes(**item)
+        except Exception as e:
+            return BytesResult(None, None, failures.describe(e))
+
+    def process_batch(self, files):
+        """Return (record, None) or (file, failure) for each (file, header) of ``files``."""
+        img_objs = []
+        outcomes = []
+        for file_obj, header in files:
+            # exceptions are not always picklable, a failure holds their message only
+            item, failure = self.process_safely(file_obj, header=header)
+            if failure is None:
+                img_objs.append((len(outcomes), item))
+            outcomes.append((item, failure))
+        # the records take the places of their files, the outcomes keep the input order
+        records = self.flush_writes([img_obj for _, img_obj in img_objs])
+        for (i, _), outcome in zip(img_objs, records):
+            outcomes[i] = outcome
+        return outcomes
+
+    def process_safely(self, file_obj, header=None):
+        """Return (img_obj, None), or (file_obj, failure) once the retries are spent."""
+        attempts = 1
+        while True:
+            try:
+                return self.process(file_obj, header=header), None
+            except Exception as e:
+                if attempts > self.retries or not failures.is_transient(e):
+                    if not isinstance(e, failures.WriteFailure):
+                        self.mirror_undated(file_obj)
+                    return file_obj, failures.describe(e, attempts)
+            self.stats.incr("retry")
+            time.sleep(self.retry_delay * 2 ** (attempts - 1))
+            attempts += 1
+            # read the file again, the prefetched head may be what failed
+            header = None
+
+    def mirror_undated(self, file_obj):
+        # files that could not be read are still mirrored into dest_dir, as plain clones
+        if self.dry_run or not self.copying():
+            return
+        try:
+            self.date_saver.mirror(ImgObject(file_obj))
+        except Exception:
+            # the error that stopped the processing is the one reported
+            pass
+
+    def chooses_lazily(self):
+        if self.all_dates:
+            return False
+        chooser, finder = type(self.date_chooser), type(self.date_finder)
+        # custom ones may only have choose() and get_dates()
+        if not hasattr(chooser, "choose_lazy"):
+            return False
+        if not all(hasattr(finder, name) for name in LAZY_FINDER_METHODS):
+            return False
+        # nor can the lazy methods they inherited stand in for their own choose() or get_dates()
+        if chooser.choose is not ImageDateChooser.choose:
+            if chooser.choose_lazy is ImageDateChooser.choose_lazy:
+                return False
+        if finder.get_dates is not ImageDateFinder.get_dates:
+            if finder.start is ImageDateFinder.start:
+                return False
+        return True
+
+    def copying(self):
+        # a custom date_saver may not copy at all
+        copying = getattr(self.date_saver, "copying", None)
+        return bool(copying and copying())
+
+    def process(self, file_obj, header=None):
+        img_obj = ImgObject(file_obj)
+        img_obj.header = header
+
+        stats = self.stats
+        if not self.chooses_lazily():
+            # search dates
+            with stats.stage("find"):
+                self.date_finder.get_dates(img_obj)
+            with stats.stage("choose"):
+                img_obj.choosen = self.date_chooser.choose(img_obj)
+        else:
+            # the strategies run inside, only as far as the decision needs them
+            with stats.stage("choose"):
+                img_obj.choosen = self.date_chooser.choose_lazy(img_obj, self.date_finder)
+        if not self.dry_run and (img_obj.choosen or self.copying()):
+            with stats.stage("write"):
+                try:
+                    if img_obj.choosen:
+                        self.date_saver.write(img_obj)
+                    else:
+                        # files without a date are still mirrored into dest_dir
+                        self.date_saver.mirror(img_obj)
+                except Exception as e:
+                    raise failures.WriteFailure(e) from e
+        # the dates are all that is left to need, drop the EXIF buffers now
+        img_obj.exif_dict = None
+        img_obj.header = None
+        return img_obj
+
+    def flush_writes(self, img_objs):
+        """Return (record, None) per file, or (file, failure) when it could not be written."""
+        # the records need the stat of the files once the journaled writes are on disk
+        failed = {}
+        if self.journal:
+            with self.stats.stage("sync"):
+                self.journal.commit()
+            failed, self.journal.failed = self.journal.failed, {}
+        results = []
+        for img_obj in img_objs:
+            new_name = getattr(img_obj, "new_name", None)
+            error = failed.get(os.path.abspath(new_name)) if failed and new_name else None
+            if error is not None:
+                failure = failures.describe(failures.WriteFailure(error))
+                results.append((img_obj.file_obj, failure))
+                continue
+            try:
+                results.append((self.make_record(img_obj), None))
+            except OSError as e:
+                # gone since it was processed
+                results.append((img_obj.file_obj, failures.describe(e)))
+        return results
+
+    def make_record(self, img_obj):
+        if not img_obj.choosen:
+            outcome = "nodate"
+        elif self.dry_run:
+            outcome = "dry-run"
+        else:
+            outcome = getattr(img_obj, "write_result", None)
+        stat = img_obj.stat
+        if stat is None or (img_obj.choosen and not self.dry_run):
+            # the saver touched the file, the walker stat is outdated
+            stat = img_obj.file_obj.stat()
+        return FileRecord.from_img_obj(img_obj, stat, outcome)
 
 
 class ImageDateSaver:
     def __init__(self, processor=None):
         super().__init__()
         self.processor = processor
+        # ((dest_dir, main_dir), copying) of the last check
+        self.copying_cache = None
 
     def write(self, img_obj):
-        pass
+        self.processor.date_finder.write_dates(img_obj)
+        values = self.tag_values(img_obj)
+        img_obj.new_name = self.prepare_target(img_obj)
+        journal = self.processor.journal
+        if journal is not None:
+            # written and synced with the rest of the batch
+            img_obj.write_result = journal.add(img_obj.new_name, values, self.modtime(img_obj))
+        else:
+            img_obj.write_result = exif.write_tags(img_obj.new_name, values)
+            self.change_modtime(img_obj)
+        self.processor.metrics.incr("written", img_obj.write_result)
+
+    def patch_bytes(self, img_obj):
+        # the image is only in memory, return it with the new dates
+        self.processor.date_finder.write_dates(img_obj)
+        return exif.patch_bytes(img_obj.data, self.tag_values(img_obj))
+
+    def tag_values(self, img_obj):
+        exif_dict = img_obj.exif_dict
+        values = {}
+        for etype, key in exif.WRITABLE_TAGS:
+            if key in exif_dict.get(etype, {}):
+                values[(etype, key)] = exif_dict[etype][key]
+        return values
+
+    def prepare_target(self, img_obj):
+        if not self.copying():
+            return img_obj.file_obj
+        return self.mirror(img_obj)
+
+    def copying(self):
+        processor = self.processor
+        # without a main_dir, as in imagefix.server, the files are fixed where they are
+        if processor.dest_dir is None:
+            return False
+        # the same folder can be spelled in many ways, a file cloned over itself is emptied
+        key = (processor.dest_dir, processor.main_dir)
+        if self.copying_cache is None or self.copying_cache[0] != key:
+            self.copying_cache = (key, not same_directory(*key))
+        return self.copying_cache[1]
+
+    def mirror(self, img_obj):
+        # a clone shares the data blocks with the original when the file system allows it
+        new_path = self.prepare_path(img_obj.file_obj, self.processor.dest_dir)
+        method = clone.clone_file(img_obj.file_obj, new_path)
+        self.processor.stats.incr("clone." + method)
+        return new_path
 
     def prepare_path(self, f, new_dir):
-        relative_path = Path(f).relative_to(main_dir)
+        relative_path = Path(f).relative_to(self.processor.main_dir)
         new_path = Path(new_dir).joinpath(relative_path)
         Path(new_path).parent.mkdir(parents=True, exist_ok=True)
         return new_path
 
+    def modtime(self, img_obj):
+        return time.mktime(img_obj.choosen.timetuple())
+
     def change_modtime(self, img_obj):
-        date = img_obj.choosen
-        modTime = time.mktime(date.timetuple())
+        modTime = self.modtime(img_obj)
         os.utime(img_obj.new_name, (modTime, modTime))
 
 
@@ -124,30 +1119,89 @@ class ImageDateChooser:
         "Path",
     ]
 
-    def __init__(self, processor=None):
+    def __init__(self, processor=None, min_date=None, max_date=None):
         super().__init__()
-        self.min_date = datetime(2000, 1, 1, 0, 0, 0)
-        self.max_date = datetime.now()
+        self.processor = processor
+        self.min_date = min_date if min_date else datetime(2000, 1, 1, 0, 0, 0)
+        # without an explicit max_date anything up to the start of the run is valid
+        self.max_date = max_date if max_date else datetime.now()
+        self.fixed_max_date = bool(max_date)
+
+    def config_key(self):
+        max_date = self.max_date.isoformat() if self.fixed_max_date else "now"
+        return repr((list(self.CHOOSE_ORDER), self.min_date.isoformat(), max_date))
 
     def choose(self, img_obj):
         # remove dates from today or behid date fix
         valid_dates = {k: v for k, v in img_obj.dates.items() if self.is_valid_date(v)}
 
-        print("File: {} -> Date: {}".format(img_obj.file_obj.name, valid_dates))
-
         # choose order
         choosen_date = None
-        for name in ImageDateChooser.CHOOSE_ORDER:
+        img_obj.choosen_key = None
+        img_obj.reason = "no date with time" if valid_dates else "no valid date"
+        for name in self.CHOOSE_ORDER:
             if name in valid_dates:
                 date = valid_dates[name]
                 if len(valid_dates) == 1:
                     choosen_date = date
+                    img_obj.reason = "only valid date"
                     break
                 elif self.has_seconds(date):
                     choosen_date = date
+                    img_obj.reason = "first date with time"
                     break
+        if choosen_date:
+            img_obj.choosen_key = name
+        self.count(img_obj)
         return choosen_date
 
+    def choose_lazy(self, img_obj, finder):
+        """Same as choose, but runs only the strategies needed to settle the choice."""
+        finder.start(img_obj)
+        dates = img_obj.dates
+        choosen_date = None
+        img_obj.choosen_key = None
+        for name in self.CHOOSE_ORDER:
+            finder.provide(img_obj, name)
+            date = dates.get(name)
+            if not self.is_valid_date(date):
+                continue
+            # a date without time is only taken when it is the only valid one
+            only = not self.other_valid_date(img_obj, finder, name)
+            if only or self.has_seconds(date):
+                choosen_date = date
+                img_obj.choosen_key = name
+                img_obj.reason = "only valid date" if only else "first date with time"
+                break
+        else:
+            # only all of them can tell "no valid date" from "no date with time"
+            while finder.provide_cheapest(img_obj):
+                pass
+            valid = any(self.is_valid_date(v) for v in dates.values())
+            img_obj.reason = "no date with time" if valid else "no valid date"
+        finder.finish(img_obj)
+        self.count(img_obj)
+        return choosen_date
+
+    def count(self, img_obj):
+        # without a processor, as in imagefix.index, nobody reads the counts
+        if self.processor is not None:
+            self.processor.metrics.incr("chosen", img_obj.choosen_key)
+
+    def other_valid_date(self, img_obj, finder, name):
+        while True:
+            for key, date in img_obj.dates.items():
+                if key != name and self.is_valid_date(date):
+                    return True
+            if not finder.provide_cheapest(img_obj):
+                return False
+
+    def choose_batch(self, columns):
+        # numpy is only needed for batches
+        from .batch import choose_batch
+
+        return choose_batch(columns, self.CHOOSE_ORDER, self.min_date, self.max_date)
+
     def has_seconds(self, dt_val):
         return dt_val.hour > 0 or dt_val.minute > 0
 
@@ -157,9 +1211,17 @@ class ImageDateChooser:
 
 class ImageDateFinder:
     def __init__(self, processor=None, strategies=None):
+        self.processor = processor
         self.strategies = []
         if not strategies:
-            strategies = [DateFromExifTag(), DateFromFilePathFolder(), DateFromFileDateTime()]
+            strategies = [
+                DateFromExifTag(processor=processor),
+                DateFromFilePathFolder(processor=processor),
+                DateFromFileDateTime(processor=processor),
+            ]
+        self.deferrable = False
+        # key -> the strategy finding it, when they can be deferred
+        self.providers = {}
         for strategy in strategies:
             self.register(strategy)
 
@@ -167,14 +1229,64 @@ class ImageDateFinder:
         if hasattr(strategy, "get_dates"):
             if hasattr(strategy, "write_dates"):
                 self.strategies.append(strategy)
+                self.deferrable = self.can_defer()
+
+    def can_defer(self):
+        # strategies may be skipped or run out of order only when each key has one known source
+        self.providers = {}
+        for strategy in self.strategies:
+            provides = getattr(strategy, "provides", None)
+            if provides is None or any(key in self.providers for key in provides):
+                self.providers = {}
+                return False
+            self.providers.update(dict.fromkeys(provides, strategy))
+        return True
 
     def get_dates(self, img_obj):
         for strategy in self.strategies:
-            dates = strategy.get_dates(img_obj)
-            if dates:
-                img_obj.dates.update(dates)
+            self.run_strategy(strategy, img_obj)
         return img_obj.dates
 
+    def run_strategy(self, strategy, img_obj):
+        stats = self.processor.stats if self.processor else NULL_STATS
+        if stats.enabled:
+            with stats.stage("find." + getattr(strategy, "name", type(strategy).__name__)):
+                dates = strategy.get_dates(img_obj)
+        else:
+            dates = strategy.get_dates(img_obj)
+        if dates:
+            img_obj.dates.update(dates)
+
+    def start(self, img_obj):
+        if self.deferrable:
+            img_obj.pending_strategies = list(self.strategies)
+        else:
+            img_obj.pending_strategies = []
+            self.get_dates(img_obj)
+
+    def provide(self, img_obj, key):
+        # run the strategy that finds ``key``, unless it already ran
+        strategy = self.providers.get(key)
+        pending = img_obj.pending_strategies
+        if strategy is not None and strategy in pending:
+            pending.remove(strategy)
+            self.run_strategy(strategy, img_obj)
+
+    def provide_cheapest(self, img_obj):
+        pending = img_obj.pending_strategies
+        if not pending:
+            return False
+        strategy = min(pending, key=lambda s: getattr(s, "cost", 1))
+        pending.remove(strategy)
+        self.run_strategy(strategy, img_obj)
+        return True
+
+    def finish(self, img_obj):
+        stats = self.processor.stats if self.processor else NULL_STATS
+        for strategy in img_obj.pending_strategies:
+            stats.incr("skipped." + getattr(strategy, "name", type(strategy).__name__))
+        img_obj.pending_strategies = None
+
     def write_dates(self, img_obj):
         for strategy in self.strategies:
             strategy.write_dates(img_obj)
@@ -185,34 +1297,75 @@ class DateFromExifTag:
         (
             "DateTime",
             "0th",
-            piexif.ImageIFD.DateTime,
+            exif.DATE_TIME,
         ),
-        ("DateTimeOriginal", "Exif", piexif.ExifIFD.DateTimeOriginal),
+        ("DateTimeOriginal", "Exif", exif.DATE_TIME_ORIGINAL),
         (
             "DateTimeDigitized",
             "Exif",
-            piexif.ExifIFD.DateTimeDigitized,
+            exif.DATE_TIME_DIGITIZED,
         ),
     ]
 
+    # keys found and relative cost, for the lazy finder
+    provides = ("DateTime", "DateTimeOriginal", "DateTimeDigitized", "GPSDateTime")
+    cost = 10
+
     def __init__(self, processor=None):
         self._processor = processor
         self.name = "exif"
 
     def get_dates(self, img_obj):
+        if img_obj.exif_dict is None:
+            img_obj.exif_dict = self.load_exif(img_obj.file_obj, img_obj.header, img_obj.data)
+            img_obj.header = None
         exif_dict = img_obj.exif_dict
         new_dict = {}
 
         for key, tag, exif_id in DateFromExifTag.DATES_TAGS:
-            new_dict[key] = self.read_exif_tag(exif_dict, tag, exif_id, as_string=True)
+            new_dict[key] = self.read_exif_tag(exif_dict, tag, exif_id)
 
         new_dict["GPSDateTime"] = self.get_gps_datetime(exif_dict)
         return {k: self._convert_to_timestamp(v) for k, v in new_dict.items()}
 
+    def load_exif(self, file_obj, header=None, data=None):
+        # data: the whole file, when it is only in memory
+        stats = self._processor.stats if self._processor else NULL_STATS
+        try:
+            with stats.stage("exif.read"):
+                if data is not None:
+                    exif_dict = exif.parse_exif(memoryview(data))
+                elif header is not None:
+                    try:
+                        exif_dict = exif.parse_exif(memoryview(header), partial=True)
+                    except exif.TruncatedError:
+                        # the EXIF block goes past the prefetched bytes
+                        header = None
+                if header is None and data is None:
+                    exif_dict = exif.read_exif(file_obj)
+        except exif.UnknownFormatError:
+            # not a container the reader knows, let PIL find the EXIF block
+            with stats.stage("exif.pil"):
+                # PIL and piexif are only imported for files the reader does not know
+                import piexif
+                from PIL import Image, UnidentifiedImageError
+
+                try:
+                    with Image.open(io.BytesIO(data) if data is not None else file_obj) as img:
+                        exif_bytes = img.info.get("exif")
+                except UnidentifiedImageError:
+                    # an OSError for PIL, but no retry will make it an image
+                    raise exif.UnknownFormatError("unknown image format") from None
+                exif_dict = piexif.load(exif_bytes) if exif_bytes else None
+        return exif_dict if exif_dict is not None else {}
+
     def write_dates(self, img_obj):
         choosen = img_obj.choosen
         if choosen:
-            choosen_date = choosen.strftime("%Y:%m:%d %H:%M:%S")
+            if img_obj.exif_dict is None:
+                # the choice was settled without reading the EXIF block
+                img_obj.exif_dict = self.load_exif(img_obj.file_obj, data=img_obj.data)
+            choosen_date = choosen.strftime("%Y:%m:%d %H:%M:%S").encode()
             # make backup if necessary
             if self._processor.make_backup:
                 self.backup_data(img_obj)
@@ -221,15 +1374,25 @@ class DateFromExifTag:
                 self.set_exif_tag(img_obj.exif_dict, tag, exif_id, choosen_date)
 
     def backup_data(self, img_obj):
+        # never overwrite an existing comment, it may already hold the original dates
+        comment = self.read_exif_tag(img_obj.exif_dict, "Exif", exif.USER_COMMENT)
+        if comment and comment[8:].strip(b"\x00 "):
+            return
         lst = []
         for k, v in img_obj.dates.items():
-            lst.append(k + "=" + v.strftime("%Y:%m:%d %H:%M:%S"))
+            if v:
+                lst.append(k + "=" + v.strftime("%Y:%m:%d %H:%M:%S"))
         backup_str = ";".join(lst)
-        self.set_exif_tag(img_obj.exif_dict, "Exif", piexif.ExifIFD.UserComment, backup_str)
+        self.set_exif_tag(
+            img_obj.exif_dict,
+            "Exif",
+            exif.USER_COMMENT,
+            exif.ASCII_COMMENT + backup_str.encode(),
+        )
 
     def get_gps_datetime(self, exif_dict):
-        b_gpsdate = self.read_exif_tag(exif_dict, "GPS", piexif.GPSIFD.GPSDateStamp)
-        t_gpstime = self.read_exif_tag(exif_dict, "GPS", piexif.GPSIFD.GPSTimeStamp)
+        b_gpsdate = self.read_exif_tag(exif_dict, "GPS", exif.GPS_DATE_STAMP)
+        t_gpstime = self.read_exif_tag(exif_dict, "GPS", exif.GPS_TIME_STAMP)
         b_gpsdate = b_gpsdate.decode() if isinstance(b_gpsdate, bytes) else b_gpsdate
         if isinstance(b_gpsdate, str):
             # Change date colon to dash
@@ -261,26 +1424,23 @@ class DateFromExifTag:
         return None
 
     def _convert_to_timestamp(self, exif_val):
-        if exif_val and exif_val.strip(" \\/-"):
-            exif_val = exif_val.replace("/", ":")
-            exif_val = exif_val.replace("\\", ":")
-            exif_val = exif_val.replace("-", ":")
-            try:
-                return datetime.strptime(exif_val, "%Y:%m:%d %H:%M:%S")
-            except ValueError:
-                try:
-                    return datetime.strptime(exif_val, "%Y:%m:%d")
-                except ValueError:
-                    pass
-        return None
+        # works on the raw bytes, str values (GPS) are accepted too
+        return exif.parse_datetime(exif_val)
 
 
 class DateFromFilePathFolder:
     RE = re.compile("^[0-9]{4}-[0-9]{2}-[0-9]{2}")
     RE_YEAR = re.compile("^[0-9]{4}\\s")
+    provides = ("Path",)
+    cost = 2
 
-    def __init__(self, processor=None):
+    def __init__(self, processor=None, cache_size=4096):
         self.name = "path"
+        # directory -> folder date, every file of a directory shares the answer
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
 
     def get_dates(self, img_obj):
         adate = self.str_to_date(self.find_date_or_year(img_obj))
@@ -303,24 +1463,60 @@ class DateFromFilePathFolder:
         return None
 
     def find_date_or_year(self, img_obj):
-        file_obj = img_obj.file_obj
-        for path in file_obj.parents:
-            res = DateFromFilePathFolder.RE.search(path.stem)
+        return self.folder_date(img_obj.file_obj.parent)
+
+    def folder_date(self, directory):
+        cache = self._cache
+        if directory in cache:
+            self.hits += 1
+            cache.move_to_end(directory)
+            return cache[directory]
+        self.misses += 1
+
+        # climb until a folder matches or an ancestor is already known
+        pending = []
+        result = None
+        path = directory
+        while True:
+            if path in cache:
+                result = cache[path]
+                break
+            pending.append(path)
+            result = self.match_folder(path.stem)
+            if result or path.parent == path:
+                break
+            path = path.parent
+
+        # the folders on the way inherit the nearest ancestor's date
+        for path in pending:
+            cache[path] = result
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return result
+
+    def match_folder(self, stem):
+        res = DateFromFilePathFolder.RE.search(stem)
+        if res:
+            return res.group(0)
+        else:
+            res = DateFromFilePathFolder.RE_YEAR.search(stem)
             if res:
                 return res.group(0)
-            else:
-                res = DateFromFilePathFolder.RE_YEAR.search(path.stem)
-                if res:
-                    return res.group(0)
         return None
 
+    def cache_info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache)}
+
 
 class DateFromFileDateTime:
+    provides = ("File",)
+    cost = 1
+
     def __init__(self, processor=None):
         self.name = "file"
 
     def get_dates(self, obj_img):
-        adate = self.creation_date(obj_img.file_obj)
+        adate = self.creation_date(obj_img.file_obj, obj_img.stat)
         if adate:
             return {"File": datetime.fromtimestamp(adate)}
         return {}
@@ -328,18 +1524,16 @@ class DateFromFileDateTime:
     def write_dates(self, img_obj):
         pass
 
-    def creation_date(self, path_to_file):
-        if platform.system() == "Windows":
-            return os.path.getctime(path_to_file)
-        else:
+    def creation_date(self, path_to_file, stat=None):
+        # reuse the stat made by the walker when there is one
+        if stat is None:
             stat = os.stat(path_to_file)
+        if IS_WINDOWS:
+            return stat.st_ctime
+        else:
             try:
                 return stat.st_birthtime
             except AttributeError:
                 # We're probably on Linux. No easy way to get creation dates here,
                 # so we'll settle for when its content was last modified.
                 return stat.st_mtime
-
-
-if __name__ == "__main__":
-    main()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from datetime import datetime
+
+from .record import DATE_KEYS, from_timestamp
+
+
+class DateIndex:
+    """Candidate dates of every file seen, to try other chooser rules without the images.
+
+    The dates are those read before imagefix changed the file: once a file was
+    written, its row is kept as long as the file keeps the stat of that write.
+    """
+
+    STEM = ".imagefix-index"
+    FILENAME = STEM + ".db"
+
+    def __init__(self, path, batch_size=1000):
+        super().__init__()
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = 0
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS dates ("
+            "file_path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, "
+            "choosen REAL, source TEXT, {}, packed BLOB)".format(
+                ", ".join(k + " REAL" for k in DATE_KEYS)
+            )
+        )
+        columns = ("size", "mtime_ns", "inode", "choosen", "source") + DATE_KEYS + ("packed",)
+        self.insert_sql = (
+            "INSERT INTO dates VALUES ({}) ON CONFLICT (file_path) DO UPDATE SET {} "
+            # the same stat means the file is still the one we left, its dates are ours
+            "WHERE dates.size != excluded.size OR dates.mtime_ns != excluded.mtime_ns "
+            "OR dates.inode != excluded.inode".format(
+                ", ".join("?" * (len(columns) + 1)),
+                ", ".join("{0} = excluded.{0}".format(c) for c in columns),
+            )
+        )
+
+    def record(self, key, file_record):
+        # sqlite has no NaN, missing dates are NULL
+        dates = tuple(None if math.isnan(ts) else ts for ts in file_record.dates)
+        choosen = None if math.isnan(file_record.choosen_ts) else file_record.choosen_ts
+        # the same timestamps as little endian doubles, loaded in bulk by rechoose
+        packed = array("d", [file_record.choosen_ts]) + file_record.dates
+        if sys.byteorder == "big":
+            packed.byteswap()
+        with self.lock:
+            self.conn.execute(
+                self.insert_sql,
+                (
+                    key,
+                    file_record.size,
+                    file_record.mtime_ns,
+                    file_record.inode,
+                    choosen,
+                    file_record.choosen_key,
+                )
+                + dates
+                + (packed.tobytes(),),
+            )
+            self.pending += 1
+            if self.pending >= self.batch_size:
+                self.commit()
+
+    def is_current(self, key, stat):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, inode FROM dates WHERE file_path = ?", (key,)
+            ).fetchone()
+        return row is not None and row == (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+    def merge(self, path):
+        """Add the files of the index at ``path``, the index of another shard."""
+        if not os.path.isfile(path):
+            # ATTACH would create an empty database
+            raise FileNotFoundError("no index at {}".format(path))
+        with self.lock:
+            self.commit()
+            self.conn.execute("ATTACH DATABASE ? AS other", (str(path),))
+            try:
+                self.conn.execute("INSERT OR REPLACE INTO dates SELECT * FROM other.dates")
+                self.conn.commit()
+            finally:
+                self.conn.execute("DETACH DATABASE other")
+
+    def ensure_indexes(self):
+        # built once by the first query, a run only pays for the primary key
+        with self.lock:
+            for key in DATE_KEYS:
+                self.conn.execute("CREATE INDEX IF NOT EXISTS dates_{0} ON dates ({0})".format(key))
+            self.conn.commit()
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM dates").fetchone()[0]
+
+    def disagree(self, key_a, key_b, seconds=3600):
+        """Yield (path, date a, date b) of the files whose dates are over ``seconds`` apart."""
+        for key in (key_a, key_b):
+            if key not in DATE_KEYS:
+                raise ValueError("unknown date {}, expected one of {}".format(key, DATE_KEYS))
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT file_path, {0}, {1} FROM dates WHERE ABS({0} - {1}) > ? ORDER BY 1".format(
+                    key_a, key_b
+                ),
+                (seconds,),
+            ).fetchall()
+        for path, date_a, date_b in rows:
+            yield path, from_timestamp(date_a), from_timestamp(date_b)
+
+    def rechoose(self, chooser):
+        """Choose again from the stored dates with ``chooser``, without opening any image.
+
+        Returns the number of files per new source, None for no date, and the
+        files whose date changed as (path, old date, old source, new date, new source).
+        """
+        try:
+            from . import batch
+        except ImportError:
+            # without numpy every row goes through the scalar chooser, slower but the same
+            return self.rechoose_rows(chooser)
+        import numpy as np
+
+        # one blob per file instead of seven values is what makes millions of files quick
+        with self.lock:
+            blobs = self.conn.execute("SELECT packed FROM dates ORDER BY rowid").fetchall()
+        table = np.frombuffer(b"".join(row[0] for row in blobs), dtype="<f8")
+        table = table.reshape(len(blobs), len(DATE_KEYS) + 1)
+        del blobs
+        columns = {
+            key: batch.timestamps_to_column(table[:, i + 1]) for i, key in enumerate(DATE_KEYS)
+        }
+        chosen, source = chooser.choose_batch(columns)
+        old = batch.timestamps_to_column(table[:, 0])
+        same = (chosen == old) | (np.isnat(chosen) & np.isnat(old))
+
+        order = list(chooser.CHOOSE_ORDER)
+        totals = np.bincount(source.astype(np.int64) + 1, minlength=len(order) + 1)
+        counts = dict(zip([None] + order, totals.tolist()))
+        changes = []
+        changed = np.flatnonzero(~same).tolist()
+        if changed:
+            # only the names of the changed files are read
+            with self.lock:
+                rowids = self.conn.execute("SELECT rowid FROM dates ORDER BY rowid").fetchall()
+                names = {}
+                for start in range(0, len(changed), 500):
+                    chunk = [rowids[i][0] for i in changed[start : start + 500]]
+                    names.update(
+                        (row[0], row[1:])
+                        for row in self.conn.execute(
+                            "SELECT rowid, file_path, source FROM dates WHERE rowid IN ({})".format(
+                                ", ".join("?" * len(chunk))
+                            ),
+                            chunk,
+                        )
+                    )
+            for i in changed:
+                path, old_source = names[rowids[i][0]]
+                new_source = order[source[i]] if source[i] >= 0 else None
+                changes.append(
+                    (path, from_timestamp(table[i, 0]), old_source, chosen[i].item(), new_source)
+                )
+        return counts, changes
+
+    def rechoose_rows(self, chooser):
+        from .imagefix import ImgObject
+
+        counts = dict.fromkeys([None] + list(chooser.CHOOSE_ORDER), 0)
+        changes = []
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT file_path, choosen, source, {} FROM dates".format(", ".join(DATE_KEYS))
+            ).fetchall()
+        for row in rows:
+            path, old, old_source = row[:3]
+            dates = {
+                key: from_timestamp(ts) for key, ts in zip(DATE_KEYS, row[3:]) if ts is not None
+            }
+            img_obj = ImgObject(path, dates=dates)
+            choosen = chooser.choose(img_obj)
+            counts[img_obj.choosen_key] += 1
+            old = from_timestamp(old) if old is not None else None
+            if choosen != old:
+                changes.append((path, old, old_source, choosen, img_obj.choosen_key))
+        return counts, changes
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self.commit()
+            self.conn.close()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="imagefix.index", description="Query the candidate dates recorded by imagefix runs"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    rechoose = commands.add_parser(
+        "rechoose", help="choose the dates again with other rules, without touching the images"
+    )
+    rechoose.add_argument("index", help="index written by a run, .imagefix-index.db in main_dir")
+    rechoose.add_argument("--min-date", type=parse_date, help="oldest valid date (2000-01-01)")
+    rechoose.add_argument("--max-date", type=parse_date, help="newest valid date (now)")
+    rechoose.add_argument(
+        "--order",
+        type=parse_order,
+        help="comma separated date sources, most trusted first (default: {})".format(
+            ",".join(DATE_KEYS)
+        ),
+    )
+    rechoose.add_argument(
+        "-r", "--report", help="write the files whose date changes to a .jsonl, .csv or .db report"
+    )
+    disagree = commands.add_parser(
+        "disagree", help="list the files whose two dates are further apart than a limit"
+    )
+    disagree.add_argument("index", help="index written by a run")
+    disagree.add_argument("key_a", choices=DATE_KEYS)
+    disagree.add_argument("key_b", choices=DATE_KEYS)
+    disagree.add_argument(
+        "--over", type=float, default=3600, help="seconds apart, one hour by default"
+    )
+    opts = parser.parse_args(args)
+
+    if not os.path.isfile(opts.index):
+        parser.error("no index at {}".format(opts.index))
+    index = DateIndex(opts.index)
+    try:
+        index.ensure_indexes()
+        if opts.command == "rechoose":
+            print_rechoose(index, opts)
+        else:
+            for path, date_a, date_b in index.disagree(opts.key_a, opts.key_b, opts.over):
+                print("{}\t{}\t{}\t{}".format(path, date_a, date_b, abs(date_a - date_b)))
+    finally:
+        index.close()
+
+
+def print_rechoose(index, opts):
+    from .imagefix import ImageDateChooser
+    from .report import open_sink
+
+    chooser = ImageDateChooser(min_date=opts.min_date, max_date=opts.max_date)
+    if opts.order:
+        chooser.CHOOSE_ORDER = opts.order
+    start = time.perf_counter()
+    counts, changes = index.rechoose(chooser)
+    elapsed = time.perf_counter() - start
+    out = sys.stdout
+    out.write(
+        "{} files in {:.2f}s, {} would change\n".format(sum(counts.values()), elapsed, len(changes))
+    )
+    for key, count in counts.items():
+        out.write("  {:<20} {:>10}\n".format(key or "no date", count))
+    if opts.report:
+        with open_sink(opts.report) as sink:
+            for path, old, old_source, new, new_source in changes:
+                sink.write(
+                    {
+                        "file_path": path,
+                        "choosen": old.isoformat(" ") if old else None,
+                        "choosen_key": old_source,
+                        "new_choosen": new.isoformat(" ") if new else None,
+                        "new_choosen_key": new_source,
+                    }
+                )
+
+
+def parse_date(value):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected an ISO date, got {}".format(value))
+
+
+def parse_order(value):
+    order = [key.strip() for key in value.split(",") if key.strip()]
+    for key in order:
+        if key not in DATE_KEYS:
+            raise argparse.ArgumentTypeError(
+                "unknown date {}, expected some of {}".format(key, ",".join(DATE_KEYS))
+            )
+    return order
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+import itertools
+import json
+import mmap
+import os
+import sys
+from pathlib import Path
+
+from . import exif
+
+
+class WriteJournal:
+    """Write-ahead journal of the EXIF changes, applied and synced in batches.
+
+    Every change is planned first and logged with the original bytes, the
+    batch is then applied and its files and directories synced once each.
+    After a crash, ``recover`` rolls the unfinished batches forward or
+    everything back.
+    """
+
+    DIRNAME = ".imagefix-journal"
+
+    def __init__(self, directory, batch_size=256):
+        super().__init__()
+        self.directory = Path(directory)
+        self.batch_size = batch_size
+        self.pending = []
+        self.fp = None
+        # path -> error or message, for the files a commit could not write
+        self.failed = {}
+
+    def __getstate__(self):
+        # each process logs to its own file, opened on its first batch
+        state = self.__dict__.copy()
+        state["pending"] = []
+        state["fp"] = None
+        state["failed"] = {}
+        return state
+
+    def add(self, path, values, mtime):
+        """Plan the write of ``values`` and the new ``mtime`` of ``path``, return the outcome."""
+        path = os.path.abspath(path)
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size == 0:
+                raise exif.UnknownFormatError("empty file")
+            entry = {"path": path, "times": [stat.st_atime_ns, stat.st_mtime_ns], "mtime": mtime}
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    result, patches, splice = exif.plan_write(view, values)
+                    if patches:
+                        entry["op"] = "patch"
+                        entry["patches"] = [
+                            [offset, bytes(view[offset : offset + len(data)]).hex(), data.hex()]
+                            for offset, data in patches
+                        ]
+                    elif splice:
+                        start, end, segment = splice
+                        entry["op"] = "splice"
+                        entry["start"] = start
+                        entry["old"] = bytes(view[start:end]).hex()
+                        entry["new"] = segment.hex()
+                        # only named here, the copy is made once this entry is on disk
+                        entry["tmp"] = temp_name(path)
+                    else:
+                        entry["op"] = "touch"
+                finally:
+                    view.release()
+        self.pending.append(entry)
+        if len(self.pending) >= self.batch_size:
+            self.commit()
+        return result
+
+    def open(self):
+        if self.fp is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.directory.joinpath("{}.jsonl".format(os.getpid()))
+            self.fp = open(path, "a", encoding="utf-8")
+            # a log that vanishes with its directory entry could not be recovered
+            sync_dirs([path])
+        return self.fp
+
+    def commit(self):
+        if not self.pending:
+            return
+        fp = self.open()
+        fp.write("".join(json.dumps(entry) + "\n" for entry in self.pending))
+        fp.flush()
+        os.fsync(fp.fileno())
+        # the copies are listed in the log before they exist, recover always finds them
+        made = []
+        for entry in self.pending:
+            if entry["op"] == "splice":
+                try:
+                    make_temp(entry)
+                    made.append(entry["tmp"])
+                except OSError as e:
+                    self.failed[entry["path"]] = e
+        # the new copies must be on disk before they replace the originals
+        sync_files(made)
+        for entry in self.pending:
+            if entry["path"] in self.failed:
+                continue
+            # one file that cannot be written does not stop the batch
+            try:
+                if not redo(entry, temp_ready=True):
+                    self.failed[entry["path"]] = "changed on disk before it was written"
+            except OSError as e:
+                self.failed[entry["path"]] = e
+                try:
+                    undo(entry)
+                except OSError:
+                    pass
+        written = [entry for entry in self.pending if entry["path"] not in self.failed]
+        sync_files(entry["path"] for entry in written)
+        sync_dirs(entry["path"] for entry in written if entry["op"] == "splice")
+        # an unsynced marker only means the batch is redone after a crash, which is harmless
+        fp.write(json.dumps({"op": "commit"}) + "\n")
+        fp.flush()
+        self.pending = []
+
+    def close(self):
+        self.commit()
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+    def finish(self):
+        # the run is over and every batch is synced, the journals are not needed anymore
+        self.close()
+        for path in journal_files(self.directory):
+            path.unlink()
+        if self.directory.is_dir() and not any(self.directory.iterdir()):
+            self.directory.rmdir()
+
+
+def sync_files(paths):
+    # only the files of the batch, each of them once
+    for path in set(paths):
+        fd = os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def sync_dirs(paths):
+    """Sync the directories holding ``paths`` once each, to make their renames durable."""
+    if sys.platform == "win32":
+        # directories cannot be opened there, NTFS journals the renames itself
+        return
+    for directory in set(os.path.dirname(os.path.abspath(path)) for path in paths):
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+_temp_counter = itertools.count()
+
+
+def temp_name(path):
+    # unique per process, the other processes journal to their own logs
+    directory, name = os.path.split(path)
+    return os.path.join(directory, ".{}.{}-{}.tmp".format(name, os.getpid(), next(_temp_counter)))
+
+
+def make_temp(entry):
+    start = entry["start"]
+    end = start + len(entry["old"]) // 2
+    exif.write_temp(entry["path"], start, end, bytes.fromhex(entry["new"]), entry["tmp"])
+
+
+def remove_temp(entry):
+    try:
+        os.unlink(entry["tmp"])
+    except FileNotFoundError:
+        pass
+
+
+def journal_files(directory):
+    directory = Path(directory)
+    if not directory.is_dir():
+        return []
+    return sorted(directory.glob("*.jsonl"))
+
+
+def read_batches(path):
+    """Return the committed entries and the entries of the unfinished batch."""
+    committed, pending = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # torn last line, its batch was never applied
+                break
+            if entry["op"] == "commit":
+                committed.extend(pending)
+                pending = []
+            else:
+                pending.append(entry)
+    return committed, pending
+
+
+def recover(directory, rollback=False):
+    """Finish or undo what the journals in ``directory`` recorded.
+
+    Resuming redoes the unfinished batches, rolling back restores the original
+    bytes and times of every journaled file. The temporary copies the journals
+    list are removed either way. Returns the paths that changed since they
+    were journaled and were left alone.
+    """
+    conflicts = []
+    paths = []
+    for journal in journal_files(directory):
+        committed, pending = read_batches(journal)
+        if rollback:
+            entries = reversed(committed + pending)
+        else:
+            entries = pending
+        for entry in entries:
+            paths.append(entry["path"])
+            if not (undo(entry) if rollback else redo(entry)):
+                conflicts.append(entry["path"])
+        for entry in committed + pending:
+            if entry["op"] == "splice":
+                remove_temp(entry)
+    paths = [p for p in paths if os.path.exists(p)]
+    if paths:
+        sync_files(paths)
+        sync_dirs(paths)
+    WriteJournal(directory).finish()
+    return conflicts
+
+
+def redo(entry, temp_ready=False):
+    """Apply ``entry``, False when the file changed since it was journaled.
+
+    ``temp_ready`` tells that the copy of a splice was just made and synced,
+    otherwise a copy left by a crash may be incomplete and is made again.
+    """
+    path = entry["path"]
+    op = entry["op"]
+    if op == "patch":
+        if not write_patches(path, entry["patches"], 2):
+            return False
+    elif op == "splice":
+        if temp_ready:
+            os.replace(entry["tmp"], path)
+        elif not segment_is(path, entry["start"], entry["new"]):
+            if not segment_is(path, entry["start"], entry["old"]):
+                return False
+            make_temp(entry)
+            sync_files([entry["tmp"]])
+            os.replace(entry["tmp"], path)
+    os.utime(path, (entry["mtime"], entry["mtime"]))
+    return True
+
+
+def undo(entry):
+    path = entry["path"]
+    op = entry["op"]
+    if op == "patch":
+        if not write_patches(path, entry["patches"], 1):
+            return False
+    elif op == "splice":
+        # a copy that never replaced the original
+        remove_temp(entry)
+        if segment_is(path, entry["start"], entry["new"]):
+            start = entry["start"]
+            end = start + len(entry["new"]) // 2
+            # under the listed name, a crash meanwhile leaves nothing unknown behind
+            exif.write_temp(path, start, end, bytes.fromhex(entry["old"]), entry["tmp"])
+            sync_files([entry["tmp"]])
+            os.replace(entry["tmp"], path)
+        elif not segment_is(path, entry["start"], entry["old"]):
+            return False
+    os.utime(path, ns=tuple(entry["times"]))
+    return True
+
+
+def write_patches(path, patches, column):
+    # column 1 holds the original bytes, column 2 the new ones
+    patches = [(offset, bytes.fromhex(old), bytes.fromhex(new)) for offset, old, new in patches]
+    with open(path, "r+b") as f:
+        for offset, old, new in patches:
+            f.seek(offset)
+            if f.read(len(new)) not in (old, new):
+                return False
+        for patch in patches:
+            f.seek(patch[0])
+            f.write(patch[column])
+    return True
+
+
+def segment_is(path, start, segment_hex):
+    segment = bytes.fromhex(segment_hex)
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(len(segment)) == segment
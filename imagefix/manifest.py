@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import threading
+
+
+class RunManifest:
+    STEM = ".imagefix-manifest"
+    FILENAME = STEM + ".db"
+
+    def __init__(self, path, reset=False, batch_size=500):
+        super().__init__()
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = 0
+        # lookups come from the pool feeder thread while results are recorded in the main one
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, "
+            "choosen TEXT, outcome TEXT)"
+        )
+        if reset:
+            self.reset()
+
+    def check_config(self, config_key):
+        # entries recorded under another chooser configuration are worthless
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'config'").fetchone()
+            if row is None or row[0] != config_key:
+                self.reset()
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('config', ?)", (config_key,))
+                self.conn.commit()
+
+    def reset(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM files")
+            self.conn.commit()
+
+    def is_current(self, key, stat):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, inode FROM files WHERE path = ?", (key,)
+            ).fetchone()
+        return row is not None and row == (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+    def get(self, key):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT choosen, outcome FROM files WHERE path = ?", (key,)
+            ).fetchone()
+
+    def record(self, key, file_record):
+        choosen = file_record.choosen
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    file_record.size,
+                    file_record.mtime_ns,
+                    file_record.inode,
+                    choosen.isoformat(" ") if choosen else None,
+                    file_record.outcome,
+                ),
+            )
+            self.pending += 1
+            if self.pending >= self.batch_size:
+                self.commit()
+
+    def merge(self, path):
+        """Add the files recorded in the manifest at ``path``, of the same configuration."""
+        if not os.path.isfile(path):
+            # ATTACH would create an empty database
+            raise FileNotFoundError("no manifest at {}".format(path))
+        with self.lock:
+            self.commit()
+            self.conn.execute("ATTACH DATABASE ? AS other", (str(path),))
+            try:
+                row = self.conn.execute(
+                    "SELECT value FROM other.meta WHERE key = 'config'"
+                ).fetchone()
+                config = self.conn.execute("SELECT value FROM meta WHERE key = 'config'").fetchone()
+                if config is None and row is not None:
+                    self.conn.execute("INSERT INTO meta VALUES ('config', ?)", row)
+                elif row != config:
+                    raise ValueError("{} was made with another configuration".format(path))
+                self.conn.execute("INSERT OR REPLACE INTO files SELECT * FROM other.files")
+                self.conn.commit()
+            finally:
+                self.conn.execute("DETACH DATABASE other")
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self.commit()
+            self.conn.close()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import os
+
+from .index import DateIndex
+from .manifest import RunManifest
+from .report import open_sink, read_records
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="imagefix.merge", description="Merge the reports, manifests or indexes of sharded runs"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    reports = commands.add_parser("reports", help="concatenate per-shard reports")
+    reports.add_argument("output", help="merged .jsonl, .csv or .db report")
+    reports.add_argument("inputs", nargs="+", help="shard reports, in any report format")
+    manifests = commands.add_parser("manifests", help="combine per-shard manifests")
+    manifests.add_argument("output", help="merged manifest, created or extended")
+    manifests.add_argument("inputs", nargs="+", help="shard manifests")
+    indexes = commands.add_parser("indexes", help="combine per-shard date indexes")
+    indexes.add_argument("output", help="merged index, created or extended")
+    indexes.add_argument("inputs", nargs="+", help="shard indexes")
+    opts = parser.parse_args(args)
+
+    if opts.command == "reports":
+        count = merge_reports(opts.output, opts.inputs)
+    elif opts.command == "manifests":
+        count = merge_manifests(opts.output, opts.inputs)
+    else:
+        count = merge_indexes(opts.output, opts.inputs)
+    print("{} records merged into {}".format(count, opts.output))
+
+
+def merge_reports(output, inputs):
+    # shards are disjoint, concatenating them covers the tree exactly once
+    count = 0
+    with open_sink(output) as sink:
+        for path in inputs:
+            for record in read_records(path):
+                sink.write(record)
+                count += 1
+    return count
+
+
+def merge_manifests(output, inputs):
+    manifest = RunManifest(os.fspath(output))
+    try:
+        for path in inputs:
+            manifest.merge(path)
+        return manifest.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+    finally:
+        manifest.close()
+
+
+def merge_indexes(output, inputs):
+    index = DateIndex(os.fspath(output))
+    try:
+        for path in inputs:
+            index.merge(path)
+        return index.count()
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+
+# counter, Prometheus name, label, help
+COUNTERS = (
+    ("seen", "imagefix_files_seen_total", None, "Image files found by the walker."),
+    ("skipped", "imagefix_files_skipped_total", None, "Files unchanged since a previous run."),
+    ("processed", "imagefix_files_processed_total", None, "Files dated, changed or not."),
+    ("fixed", "imagefix_files_fixed_total", None, "Files whose new dates were written."),
+    ("failed", "imagefix_files_failed_total", "category", "Files that failed, by category."),
+    ("chosen", "imagefix_dates_chosen_total", "source", "Chosen dates, by their source."),
+    ("written", "imagefix_writes_total", "result", "Files written, by how the EXIF changed."),
+)
+
+
+class Metrics:
+    """Counters of a run, cheap enough to be bumped several times for every file.
+
+    Each thread counts into its own dict, so the walker and the result loop
+    never wait on each other, and the readers add the dicts up.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        super().__init__()
+        self.local = threading.local()
+        # one {(name, label): count} per thread that counted something
+        self.threads = []
+        self.lock = threading.Lock()
+        # files the pre-count found, None until it is done
+        self.expected = None
+        self.started = time.time()
+        self.finished = False
+
+    def __getstate__(self):
+        # the pool workers count into their own, drained with each chunk
+        return {"expected": None, "started": self.started, "finished": False}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.__dict__.update(state)
+
+    def counters(self):
+        try:
+            return self.local.counters
+        except AttributeError:
+            counters = self.local.counters = {}
+            with self.lock:
+                self.threads.append(counters)
+            return counters
+
+    def incr(self, name, label=None, n=1):
+        try:
+            counters = self.local.counters
+        except AttributeError:
+            counters = self.counters()
+        key = (name, label)
+        counters[key] = counters.get(key, 0) + n
+
+    def drain(self):
+        # only called by the pool workers, which count from a single thread
+        counters = self.snapshot()
+        with self.lock:
+            for thread_counters in self.threads:
+                thread_counters.clear()
+        return counters or None
+
+    def merge(self, counters):
+        own = self.counters()
+        for key, n in counters.items():
+            own[key] = own.get(key, 0) + n
+
+    def snapshot(self):
+        totals = {}
+        with self.lock:
+            threads = list(self.threads)
+        for thread_counters in threads:
+            # a copy is atomic, the owner may go on counting meanwhile
+            for key, n in thread_counters.copy().items():
+                totals[key] = totals.get(key, 0) + n
+        return totals
+
+
+class NullMetrics:
+    # stands in when nobody reads the metrics
+    enabled = False
+
+    def incr(self, name, label=None, n=1):
+        pass
+
+    def drain(self):
+        return None
+
+    def merge(self, counters):
+        pass
+
+
+def total(counters, name):
+    return sum(n for (key, _), n in counters.items() if key == name)
+
+
+def format_textfile(metrics):
+    counters = metrics.snapshot()
+    lines = []
+    for name, prom_name, label, help_text in COUNTERS:
+        lines.append("# HELP {} {}".format(prom_name, help_text))
+        lines.append("# TYPE {} counter".format(prom_name))
+        values = sorted((key[1], n) for key, n in counters.items() if key[0] == name)
+        if label is None:
+            lines.append("{} {}".format(prom_name, sum(n for _, n in values)))
+        for value, n in values:
+            if label is not None:
+                lines.append('{}{{{}="{}"}} {}'.format(prom_name, label, escape(value), n))
+    gauges = [
+        ("imagefix_run_start_time_seconds", "Unix time the run started.", metrics.started),
+        ("imagefix_run_finished", "1 once the run is over.", int(metrics.finished)),
+    ]
+    if metrics.expected is not None:
+        gauges.append(
+            ("imagefix_files_expected", "Image files counted before the run.", metrics.expected)
+        )
+    for prom_name, help_text, value in gauges:
+        lines.append("# HELP {} {}".format(prom_name, help_text))
+        lines.append("# TYPE {} gauge".format(prom_name))
+        lines.append("{} {}".format(prom_name, value))
+    return "\n".join(lines) + "\n"
+
+
+def escape(value):
+    value = "none" if value is None else str(value)
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def write_textfile(metrics, path):
+    # the collector only reads *.prom, and sees the old file or the new one, never half of one
+    tmp_name = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_name, "w", encoding="utf-8") as f:
+        f.write(format_textfile(metrics))
+    os.replace(tmp_name, path)
+
+
+def format_progress(metrics, elapsed):
+    counters = metrics.snapshot()
+    skipped = total(counters, "skipped")
+    failed = total(counters, "failed")
+    done = total(counters, "processed") + skipped + failed
+    rate = done / elapsed if elapsed > 0 else 0.0
+    expected = metrics.expected
+    if expected is None:
+        head = "{} files, counting".format(done)
+    else:
+        expected = max(expected, done)
+        head = "{}/{} files {:3.0f}%".format(
+            done, expected, 100.0 * done / expected if expected else 100
+        )
+        if rate > 0 and not metrics.finished:
+            head += " ETA {}".format(format_seconds((expected - done) / rate))
+    return "{}, {:.0f} files/s, fixed {}, skipped {}, failed {}".format(
+        head, rate, total(counters, "fixed"), skipped, failed
+    )
+
+
+def format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{}:{:02d}:{:02d}".format(hours, minutes, seconds)
+
+
+class MetricsPublisher:
+    """Writes the metrics of a run from a background thread while it goes on.
+
+    The textfile is rewritten every ``interval`` seconds, the progress line,
+    when there is a stream for it, every ``refresh`` seconds.
+    """
+
+    def __init__(self, metrics, path=None, progress=None, interval=15.0, refresh=0.5):
+        super().__init__()
+        self.metrics = metrics
+        self.path = path
+        self.progress = progress
+        self.interval = interval
+        self.refresh = refresh
+        self.started = time.monotonic()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.line_length = 0
+
+    def precount(self, count):
+        """Set the expected number of files to ``count()``, computed in the background."""
+
+        def run():
+            self.metrics.expected = count()
+
+        threading.Thread(target=run, name="imagefix-precount", daemon=True).start()
+
+    def start(self):
+        if self.path:
+            self.write()
+        self.thread = threading.Thread(target=self.run, name="imagefix-metrics", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        tick = self.refresh if self.progress else self.interval
+        next_write = time.monotonic() + self.interval
+        while not self.stopped.wait(tick):
+            if self.progress:
+                self.show_progress()
+            if self.path and time.monotonic() >= next_write:
+                self.write()
+                next_write = time.monotonic() + self.interval
+
+    def write(self):
+        try:
+            write_textfile(self.metrics, self.path)
+        except OSError:
+            # a full or missing directory must not stop the run, the next write may succeed
+            pass
+
+    def show_progress(self):
+        line = format_progress(self.metrics, time.monotonic() - self.started)
+        # pad over the end of a longer previous line
+        self.progress.write("\r" + line.ljust(self.line_length))
+        self.progress.flush()
+        self.line_length = len(line)
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.metrics.finished = True
+        if self.path:
+            self.write()
+        if self.progress:
+            self.show_progress()
+            self.progress.write("\n")
+            self.progress.flush()
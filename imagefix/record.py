@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import math
+from array import array
+from datetime import datetime, timedelta
+from enum import IntEnum
+
+
+class DateSource(IntEnum):
+    GPSDateTime = 0
+    DateTimeOriginal = 1
+    DateTime = 2
+    DateTimeDigitized = 3
+    File = 4
+    Path = 5
+
+
+DATE_KEYS = tuple(source.name for source in DateSource)
+
+# naive timestamps, no timezone or DST involved
+EPOCH = datetime(1970, 1, 1)
+ONE_SECOND = timedelta(seconds=1)
+MISSING = math.nan
+
+
+def to_timestamp(dt_val):
+    return (dt_val - EPOCH) / ONE_SECOND if dt_val else MISSING
+
+
+def from_timestamp(ts):
+    return None if math.isnan(ts) else EPOCH + timedelta(seconds=ts)
+
+
+class FileRecord:
+    """Compact result of one file, cheap to buffer and to send between processes."""
+
+    __slots__ = (
+        "path",
+        "size",
+        "mtime_ns",
+        "inode",
+        "dates",
+        "choosen_ts",
+        "source_index",
+        "reason",
+        "outcome",
+    )
+
+    def __init__(self, path, size=0, mtime_ns=0, inode=0, dates=None, choosen=None):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.inode = inode
+        # one timestamp per DateSource position, NaN when missing
+        self.dates = dates if dates is not None else array("d", [MISSING] * len(DATE_KEYS))
+        self.choosen_ts = to_timestamp(choosen)
+        self.source_index = -1
+        self.reason = None
+        self.outcome = None
+
+    @classmethod
+    def from_img_obj(cls, img_obj, stat=None, outcome=None):
+        stat = stat if stat is not None else img_obj.stat
+        record = cls(
+            str(img_obj.file_obj),
+            stat.st_size if stat else 0,
+            stat.st_mtime_ns if stat else 0,
+            stat.st_ino if stat else 0,
+            array("d", [to_timestamp(img_obj.dates.get(key)) for key in DATE_KEYS]),
+            img_obj.choosen,
+        )
+        if img_obj.choosen_key in DATE_KEYS:
+            record.source_index = DateSource[img_obj.choosen_key]
+        record.reason = img_obj.reason
+        record.outcome = outcome
+        return record
+
+    @property
+    def choosen(self):
+        return from_timestamp(self.choosen_ts)
+
+    @property
+    def source(self):
+        return DateSource(self.source_index) if self.source_index >= 0 else None
+
+    @property
+    def choosen_key(self):
+        return DATE_KEYS[self.source_index] if self.source_index >= 0 else None
+
+    def date(self, key):
+        return from_timestamp(self.dates[DateSource[key]])
+
+    def dates_dict(self):
+        return {
+            key: from_timestamp(ts) for key, ts in zip(DATE_KEYS, self.dates) if not math.isnan(ts)
+        }
+
+    def __getstate__(self):
+        # a plain tuple, without the slot names, keeps the IPC payload small
+        return (
+            self.path,
+            self.size,
+            self.mtime_ns,
+            self.inode,
+            self.dates.tobytes(),
+            self.choosen_ts,
+            self.source_index,
+            self.reason,
+            self.outcome,
+        )
+
+    def __setstate__(self, state):
+        (
+            self.path,
+            self.size,
+            self.mtime_ns,
+            self.inode,
+            dates,
+            self.choosen_ts,
+            self.source_index,
+            self.reason,
+            self.outcome,
+        ) = state
+        self.dates = array("d")
+        self.dates.frombytes(dates)
+
+    def __repr__(self):
+        return "FileRecord({!r}, choosen={}, source={})".format(
+            self.path, self.choosen, self.choosen_key
+        )
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+import sqlite3
+
+from .record import DATE_KEYS
+
+
+def build_record(file_record, date_keys=DATE_KEYS):
+    choosen = file_record.choosen
+    record = {
+        "file_path": file_record.path,
+        "choosen": choosen.isoformat(" ") if choosen else None,
+        "choosen_key": file_record.choosen_key,
+        "reason": file_record.reason,
+        "outcome": file_record.outcome,
+    }
+    for key in date_keys:
+        value = file_record.date(key) if key in DATE_KEYS else None
+        record[key] = value.isoformat(" ") if value else None
+    return record
+
+
+def open_sink(path, batch_size=1000):
+    suffix = str(path).lower().rsplit(".", 1)[-1]
+    if suffix in ("jsonl", "json"):
+        return JsonlSink(path, batch_size=batch_size)
+    if suffix == "csv":
+        return CsvSink(path, batch_size=batch_size)
+    if suffix in ("db", "sqlite", "sqlite3"):
+        return SqliteSink(path, batch_size=batch_size)
+    raise ValueError("unknown report format: {}".format(path))
+
+
+def read_records(path):
+    """Yield the records of a report written by one of the sinks."""
+    suffix = str(path).lower().rsplit(".", 1)[-1]
+    if suffix in ("jsonl", "json"):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif suffix == "csv":
+        with open(path, encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                # csv writes None as an empty field
+                yield {k: v if v != "" else None for k, v in row.items()}
+    elif suffix in ("db", "sqlite", "sqlite3"):
+        conn = sqlite3.connect(str(path))
+        conn.row_factory = sqlite3.Row
+        try:
+            for row in conn.execute("SELECT * FROM {}".format(SqliteSink.TABLE)):
+                yield dict(row)
+        finally:
+            conn.close()
+    else:
+        raise ValueError("unknown report format: {}".format(path))
+
+
+class ReportSink:
+    def __init__(self, path, batch_size=1000):
+        super().__init__()
+        self.path = path
+        self.batch_size = batch_size
+        self.buffer = []
+
+    def write(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.write_batch(self.buffer)
+            self.buffer = []
+
+    def write_batch(self, records):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class JsonlSink(ReportSink):
+    def __init__(self, path, batch_size=1000):
+        super().__init__(path, batch_size=batch_size)
+        self.fp = open(path, "w", encoding="utf-8")
+
+    def write_batch(self, records):
+        self.fp.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+
+    def close(self):
+        super().close()
+        self.fp.close()
+
+
+class CsvSink(ReportSink):
+    def __init__(self, path, batch_size=1000):
+        super().__init__(path, batch_size=batch_size)
+        self.fp = open(path, "w", encoding="utf-8", newline="")
+        self.writer = None
+
+    def write_batch(self, records):
+        if self.writer is None:
+            # the columns are those of the first record, all records share them
+            self.writer = csv.DictWriter(self.fp, fieldnames=list(records[0]))
+            self.writer.writeheader()
+        self.writer.writerows(records)
+
+    def close(self):
+        super().close()
+        self.fp.close()
+
+
+class SqliteSink(ReportSink):
+    TABLE = "report"
+
+    def __init__(self, path, batch_size=1000):
+        super().__init__(path, batch_size=batch_size)
+        self.conn = sqlite3.connect(str(path))
+        self.columns = None
+
+    def write_batch(self, records):
+        if self.columns is None:
+            self.columns = list(records[0])
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS {} ({})".format(
+                    self.TABLE, ", ".join('"{}"'.format(c) for c in self.columns)
+                )
+            )
+        sql = "INSERT INTO {} VALUES ({})".format(self.TABLE, ", ".join("?" * len(self.columns)))
+        # one transaction per batch
+        with self.conn:
+            self.conn.executemany(sql, [tuple(r[c] for c in self.columns) for r in records])
+
+    def close(self):
+        super().close()
+        self.conn.close()
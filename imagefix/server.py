@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import queue
+import signal
+import socket
+import sys
+import threading
+from datetime import datetime
+
+from . import failures
+from . import imagefix as imagefix_module
+from .imagefix import FileEntry, ImageDateChooser, ImageProcessor, parse_extensions
+from .journal import WriteJournal, recover
+from .report import build_record
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="imagefix.server",
+        description="Keep imagefix running and fix the files named in JSON lines, one per "
+        'request: {"id": 1, "paths": ["a.jpg", "dir"]}, {"op": "ping"} or {"op": "shutdown"}',
+    )
+    parser.add_argument(
+        "--socket", help="listen on this Unix domain socket instead of stdin and stdout"
+    )
+    parser.add_argument(
+        "--max-clients",
+        type=int,
+        default=8,
+        help="socket connections served at once, more are turned away",
+    )
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=64,
+        help="requests queued before the clients are made to wait",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes, kept for the whole session (0 uses one per CPU)",
+    )
+    parser.add_argument(
+        "-e",
+        "--extensions",
+        type=parse_extensions,
+        help="comma separated file extensions processed in the requested directories",
+    )
+    parser.add_argument(
+        "-b",
+        "--backup",
+        action="store_true",
+        help="keep the original dates in the EXIF UserComment before changing them",
+    )
+    parser.add_argument(
+        "-n", "--dry-run", action="store_true", help="choose dates but do not write them"
+    )
+    parser.add_argument(
+        "--journal",
+        help="journal the writes in this directory, finishing the writes left by a crash first",
+    )
+    parser.add_argument(
+        "--write-batch",
+        type=int,
+        default=256,
+        help="files written and synced together when journaling",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=2,
+        help="tries again after a transient I/O error, waiting longer each time",
+    )
+    opts = parser.parse_args(args)
+    if opts.socket and not hasattr(socket, "AF_UNIX"):
+        parser.error("Unix domain sockets are not available here")
+
+    journal = None
+    if opts.journal and not opts.dry_run:
+        for path in recover(opts.journal):
+            print("Changed since it was journaled, left alone: {}".format(path), file=sys.stderr)
+        journal = WriteJournal(opts.journal, batch_size=opts.write_batch)
+    processor = ImageProcessor(
+        workers=opts.workers,
+        dry_run=opts.dry_run,
+        journal=journal,
+        make_backup=opts.backup,
+        accept_extensions=opts.extensions,
+        retries=opts.retries,
+    )
+    # every answer is a report record, with all the candidate dates
+    processor.all_dates = True
+    server = Server(processor, max_clients=opts.max_clients, max_pending=opts.max_pending)
+    # finish what was asked for, never stop in the middle of a write
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: server.shutdown())
+    if opts.socket:
+        server.serve_socket(opts.socket)
+    else:
+        server.serve_stream(sys.stdin, sys.stdout)
+
+
+def _process_request_chunk(args):
+    entries, max_date = args
+    chooser = imagefix_module._worker_processor.date_chooser
+    if not getattr(chooser, "fixed_max_date", True):
+        # the pool outlives many requests, its workers get the date of the request
+        chooser.max_date = max_date
+    return imagefix_module._process_chunk(entries)
+
+
+class Server:
+    """One ImageProcessor kept warm for every request, with its caches and worker pool.
+
+    The requests of all the clients go through a bounded queue to a single
+    thread that owns the processor, and each file is answered with its report
+    record as soon as it is written.
+    """
+
+    def __init__(self, processor, max_clients=8, max_pending=64, chunksize=32):
+        super().__init__()
+        self.processor = processor
+        self.max_clients = max_clients
+        self.chunksize = chunksize
+        self.requests = queue.Queue(max_pending)
+        self.clients = threading.BoundedSemaphore(max_clients)
+        self.stopping = threading.Event()
+        self.worker = None
+        self.pool = None
+
+    def start(self):
+        if self.processor.workers > 1:
+            import multiprocessing
+
+            self.pool = multiprocessing.Pool(
+                self.processor.workers,
+                initializer=imagefix_module._init_worker,
+                initargs=(self.processor,),
+            )
+        self.worker = threading.Thread(target=self.work, name="imagefix-server")
+        self.worker.start()
+
+    def shutdown(self):
+        # only sets a flag, signal handlers call it
+        self.stopping.set()
+
+    def stop(self):
+        """Answer the requests already queued, then release the processor."""
+        self.requests.put(None)
+        self.worker.join()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+        if self.processor.journal:
+            self.processor.journal.finish()
+
+    def serve_stream(self, infile, outfile):
+        reply = self.replier(outfile)
+        reader = threading.Thread(target=self.read_lines, args=(infile, reply), daemon=True)
+        self.start()
+        try:
+            reader.start()
+            # the end of the input stops the server like a shutdown request
+            while not self.stopping.wait(0.5):
+                pass
+        finally:
+            self.stop()
+
+    def read_lines(self, infile, reply):
+        try:
+            for line in infile:
+                if self.stopping.is_set():
+                    break
+                if line.strip():
+                    self.submit(line, reply)
+        finally:
+            self.shutdown()
+
+    def serve_socket(self, path):
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except OSError:
+                # left by a server that did not stop cleanly
+                os.unlink(path)
+            else:
+                raise OSError("another server is listening on {}".format(path))
+            finally:
+                probe.close()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(self.max_clients)
+        listener.settimeout(0.5)
+        self.start()
+        try:
+            while not self.stopping.is_set():
+                try:
+                    conn, _ = listener.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                if not self.clients.acquire(blocking=False):
+                    self.refuse(conn, "too many clients, at most {}".format(self.max_clients))
+                    continue
+                threading.Thread(target=self.serve_client, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+            os.unlink(path)
+            self.stop()
+
+    def refuse(self, conn, message):
+        try:
+            conn.sendall(encode({"id": None, "error": message}).encode("utf-8"))
+        except OSError:
+            pass
+        conn.close()
+
+    def serve_client(self, conn):
+        try:
+            with conn, conn.makefile("r", encoding="utf-8") as infile:
+                writer = conn.makefile("w", encoding="utf-8")
+                reply = self.replier(writer)
+                answered = []
+                for line in infile:
+                    if line.strip():
+                        answered.append(self.submit(line, reply))
+                # the client closed its side, its answers are still on their way
+                for event in answered:
+                    event.wait()
+                writer.close()
+        except OSError:
+            pass
+        finally:
+            self.clients.release()
+
+    def replier(self, outfile):
+        lock = threading.Lock()
+        closed = []
+
+        def reply(message):
+            with lock:
+                if closed:
+                    return
+                try:
+                    outfile.write(encode(message))
+                    outfile.flush()
+                except (OSError, ValueError):
+                    # the client went away, the request is still carried out
+                    closed.append(True)
+
+        return reply
+
+    def submit(self, line, reply):
+        answered = threading.Event()
+        if self.stopping.is_set():
+            reply({"id": None, "error": "shutting down"})
+            answered.set()
+        else:
+            # blocks while the queue is full, the client waits instead of the memory growing
+            self.requests.put((line, reply, answered))
+        return answered
+
+    def work(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                return
+            line, reply, answered = item
+            try:
+                self.answer(line, reply)
+            except Exception as e:
+                reply({"id": None, "error": "{}: {}".format(type(e).__name__, e)})
+            finally:
+                answered.set()
+
+    def answer(self, line, reply):
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            reply({"id": None, "error": "invalid request: {}".format(e)})
+            return
+        request_id = request.get("id")
+        op = request.get("op", "fix")
+        if op == "ping":
+            reply({"id": request_id, "ok": True})
+            return
+        if op == "shutdown":
+            reply({"id": request_id, "ok": True})
+            self.shutdown()
+            return
+        paths = request.get("paths")
+        if paths is None and "path" in request:
+            paths = [request["path"]]
+        if op != "fix" or not isinstance(paths, list):
+            reply({"id": request_id, "error": 'expected "path" or a list of "paths"'})
+            return
+        count = failed = 0
+        for item, failure in self.process(paths):
+            if failure is None:
+                message = build_record(item, ImageDateChooser.CHOOSE_ORDER)
+            else:
+                message = {
+                    "file_path": os.fspath(item),
+                    "category": failure.category,
+                    "error": failure.error,
+                }
+                failed += 1
+            count += 1
+            reply(dict(id=request_id, **message))
+        reply({"id": request_id, "done": True, "files": count, "failed": failed})
+
+    def process(self, paths):
+        """Yield (record, None) or (file, failure) for the files and directories in ``paths``."""
+        processor = self.processor
+        chooser = processor.date_chooser
+        if not getattr(chooser, "fixed_max_date", True):
+            chooser.max_date = datetime.now()
+        chunks = processor.iter_chunks(self.entries(paths), self.chunksize)
+        if self.pool is not None:
+            results = self.pool.imap(
+                _process_request_chunk, ((chunk, chooser.max_date) for chunk in chunks)
+            )
+            for outcomes, _, _ in results:
+                yield from outcomes
+        else:
+            for chunk in chunks:
+                # each chunk is committed by its journal before its records come back
+                yield from processor.process_batch((entry, None) for entry in chunk)
+        # the files and directories that could not be listed
+        errors, processor.errors = processor.errors, []
+        yield from errors
+
+    def entries(self, paths):
+        for path in paths:
+            path = os.fspath(path)
+            if os.path.isdir(path):
+                yield from self.processor.iter_files(path)
+                continue
+            try:
+                yield FileEntry(path, os.stat(path))
+            except OSError as e:
+                self.processor.handle_error(FileEntry(path, None), failures.describe(e))
+
+
+def encode(message):
+    return json.dumps(message, ensure_ascii=False) + "\n"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import random
+from contextlib import nullcontext
+from time import perf_counter
+
+
+class StageStats:
+    __slots__ = ("count", "total", "errors", "samples", "seen")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        # reservoir of latencies for the percentiles
+        self.samples = []
+        self.seen = 0
+
+
+class StageTimer:
+    __slots__ = ("stats", "name", "start")
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.add(self.name, perf_counter() - self.start, exc_type is not None)
+        return False
+
+
+class Stats:
+    enabled = True
+
+    def __init__(self, max_samples=10000, seed=0):
+        super().__init__()
+        self.max_samples = max_samples
+        self.stages = {}
+        self.counters = {}
+        self.callbacks = []
+        self.hooks = []
+        self._random = random.Random(seed)
+
+    def stage(self, name):
+        return StageTimer(self, name)
+
+    def add(self, name, seconds, error=False):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = StageStats()
+        stage.count += 1
+        stage.total += seconds
+        if error:
+            stage.errors += 1
+        self._sample(stage, seconds)
+        for hook in self.hooks:
+            hook(name, seconds, error)
+
+    def _sample(self, stage, seconds):
+        stage.seen += 1
+        if len(stage.samples) < self.max_samples:
+            stage.samples.append(seconds)
+        else:
+            i = self._random.randrange(stage.seen)
+            if i < self.max_samples:
+                stage.samples[i] = seconds
+
+    def incr(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_callback(self, callback):
+        # called with the summary at the end of the run
+        self.callbacks.append(callback)
+
+    def add_hook(self, hook):
+        # called with (stage, seconds, error) for every measurement
+        self.hooks.append(hook)
+
+    def drain(self):
+        # raw numbers collected since the last drain, small enough to send between processes
+        data = {
+            "stages": {
+                name: (s.count, s.total, s.errors, s.samples) for name, s in self.stages.items()
+            },
+            "counters": self.counters,
+        }
+        self.stages = {}
+        self.counters = {}
+        return data
+
+    def merge(self, data):
+        for name, (count, total, errors, samples) in data["stages"].items():
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = StageStats()
+            stage.count += count
+            stage.total += total
+            stage.errors += errors
+            for seconds in samples:
+                self._sample(stage, seconds)
+        for name, n in data["counters"].items():
+            self.incr(name, n)
+
+    def summary(self):
+        stages = {}
+        for name, s in self.stages.items():
+            samples = sorted(s.samples)
+            stages[name] = {
+                "count": s.count,
+                "total": s.total,
+                "mean": s.total / s.count if s.count else 0.0,
+                "p50": percentile(samples, 50),
+                "p90": percentile(samples, 90),
+                "p99": percentile(samples, 99),
+                "errors": s.errors,
+            }
+        return {"stages": stages, "counters": dict(self.counters)}
+
+    def report(self, out=None):
+        summary = self.summary()
+        for callback in self.callbacks:
+            callback(summary)
+        if out is not None:
+            out.write(format_summary(summary))
+        return summary
+
+
+class NullStats:
+    # stands in when profiling is off, every stage is the same no-op context
+    enabled = False
+    _context = nullcontext()
+
+    def stage(self, name):
+        return self._context
+
+    def add(self, name, seconds, error=False):
+        pass
+
+    def incr(self, name, n=1):
+        pass
+
+    def drain(self):
+        return None
+
+    def merge(self, data):
+        pass
+
+    def report(self, out=None):
+        return None
+
+
+def percentile(sorted_samples, pct):
+    if not sorted_samples:
+        return 0.0
+    i = min(len(sorted_samples) - 1, int(round(pct / 100.0 * (len(sorted_samples) - 1))))
+    return sorted_samples[i]
+
+
+def format_summary(summary):
+    lines = [
+        "{:<16} {:>9} {:>10} {:>10} {:>10} {:>10} {:>7}".format(
+            "stage", "count", "total s", "p50 ms", "p90 ms", "p99 ms", "errors"
+        )
+    ]
+    for name, s in sorted(summary["stages"].items()):
+        lines.append(
+            "{:<16} {:>9} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>7}".format(
+                name,
+                s["count"],
+                s["total"],
+                s["p50"] * 1000,
+                s["p90"] * 1000,
+                s["p99"] * 1000,
+                s["errors"],
+            )
+        )
+    for name, n in sorted(summary["counters"].items()):
+        lines.append("{:<16} {:>9}".format(name, n))
+    return "\n".join(lines) + "\n"
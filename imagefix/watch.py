@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_CLOSE_WRITE
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+EVENT = struct.Struct("iIII")
+
+
+def open_watcher(root, settle=0.25, poll_interval=None):
+    """Return an inotify watcher of the tree at ``root``, or a polling one where it is missing."""
+    if poll_interval is None and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(root, settle=settle)
+        except OSError as e:
+            print("inotify unavailable ({}), polling instead".format(e), file=sys.stderr)
+    return PollingWatcher(root, settle=settle, interval=poll_interval or 1.0)
+
+
+class Debouncer:
+    """Holds back changed files until they stop changing for ``settle`` seconds."""
+
+    def __init__(self, settle):
+        super().__init__()
+        self.settle = settle
+        # path -> [deadline, closed by the writer, (size, mtime_ns) when last seen]
+        self.pending = {}
+
+    def touch(self, path, closed, now, signature=None):
+        # without a signature the writer is trusted to have closed the file for good
+        self.pending[path] = [now + self.settle, closed, signature]
+
+    def next_deadline(self):
+        deadlines = [entry[0] for entry in self.pending.values() if entry[1]]
+        return min(deadlines) if deadlines else None
+
+    def ready(self, now):
+        files = []
+        for path, entry in list(self.pending.items()):
+            if not entry[1] or entry[0] > now:
+                continue
+            if entry[2] is not None:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # gone, or renamed away before it settled
+                    del self.pending[path]
+                    continue
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if signature != entry[2]:
+                    # still growing, wait another round
+                    entry[0] = now + self.settle
+                    entry[2] = signature
+                    continue
+            del self.pending[path]
+            files.append(path)
+        return files
+
+
+class InotifyWatcher:
+    def __init__(self, root, settle=0.25):
+        super().__init__()
+        self.root = os.fspath(root)
+        self.debouncer = Debouncer(settle)
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self.dirs = {}
+        # set after a queue overflow, events were lost
+        self.overflowed = False
+        try:
+            self.add_tree(self.root)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def add_tree(self, top, now=None):
+        # new directories may already hold files, they are queued like new files
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                raise OSError(err, "{}: {}".format(os.strerror(err), path))
+            self.dirs[wd] = path
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif now is not None and entry.is_file():
+                        stat = entry.stat()
+                        signature = (stat.st_size, stat.st_mtime_ns)
+                        self.debouncer.touch(entry.path, True, now, signature)
+
+    def wait(self, timeout):
+        """Return the files that settled, waiting up to ``timeout`` seconds for them."""
+        now = time.monotonic()
+        deadline = self.debouncer.next_deadline()
+        if deadline is not None:
+            timeout = max(0.0, min(timeout, deadline - now))
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            self.read_events()
+        return self.debouncer.ready(time.monotonic())
+
+    def read_events(self):
+        now = time.monotonic()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, pos)
+                name = data[pos + EVENT.size : pos + EVENT.size + length].rstrip(b"\0")
+                pos += EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    self.overflowed = True
+                    continue
+                if mask & IN_IGNORED:
+                    self.dirs.pop(wd, None)
+                    continue
+                directory = self.dirs.get(wd)
+                if directory is None or not name:
+                    continue
+                path = os.path.join(directory, os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self.add_tree(path, now)
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    self.debouncer.touch(path, True, now)
+                elif mask & (IN_CREATE | IN_MODIFY):
+                    # still open for writing, wait for the close
+                    self.debouncer.touch(path, False, now)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PollingWatcher:
+    """Fallback without inotify: only directories whose mtime changed are listed again."""
+
+    def __init__(self, root, settle=0.25, interval=1.0):
+        super().__init__()
+        self.root = os.fspath(root)
+        self.debouncer = Debouncer(settle)
+        self.interval = interval
+        self.overflowed = False
+        # directory -> (mtime_ns, {file name: (size, mtime_ns)})
+        self.dirs = {}
+        self.next_poll = 0.0
+        self.scan_dir(self.root, None)
+
+    def scan_dir(self, path, now):
+        stack = [path]
+        while stack:
+            path = stack.pop()
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+                files = {}
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.path not in self.dirs:
+                                stack.append(entry.path)
+                        elif entry.is_file():
+                            stat = entry.stat()
+                            files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+            except FileNotFoundError:
+                self.dirs.pop(path, None)
+                continue
+            if now is not None:
+                old_files = self.dirs.get(path, (None, {}))[1]
+                for name, signature in files.items():
+                    if old_files.get(name) != signature:
+                        self.debouncer.touch(os.path.join(path, name), True, now, signature)
+            self.dirs[path] = (mtime_ns, files)
+
+    def poll(self, now):
+        for path, (mtime_ns, _) in list(self.dirs.items()):
+            try:
+                changed = os.stat(path).st_mtime_ns != mtime_ns
+            except FileNotFoundError:
+                del self.dirs[path]
+                continue
+            if changed:
+                self.scan_dir(path, now)
+
+    def wait(self, timeout):
+        now = time.monotonic()
+        wake = self.next_poll
+        deadline = self.debouncer.next_deadline()
+        if deadline is not None:
+            wake = min(wake, deadline)
+        time.sleep(max(0.0, min(timeout, wake - now)))
+        now = time.monotonic()
+        if now >= self.next_poll:
+            self.poll(now)
+            self.next_poll = now + self.interval
+        return self.debouncer.ready(now)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
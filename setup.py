@@ -19,5 +19,17 @@ setup(
     author_email='mperon@outlook.com',
     url='https://github.com/mperon/imagefix',
     license=license,
-    packages=find_packages(exclude=('tests', 'docs'))
+    packages=find_packages(exclude=('tests', 'docs')),
+    install_requires=['piexif', 'Pillow'],
+    extras_require={
+        'batch': ['numpy'],
+    },
+    entry_points={
+        'console_scripts': [
+            'imagefix=imagefix.imagefix:main',
+            'imagefix-merge=imagefix.merge:main',
+            'imagefix-index=imagefix.index:main',
+            'imagefix-server=imagefix.server:main',
+        ],
+    },
 )
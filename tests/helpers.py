@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import piexif
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parents[1]
+
+FULL_EXIF = {
+    "0th": {piexif.ImageIFD.DateTime: b"2015:06:01 10:20:30", piexif.ImageIFD.Make: b"Cam"},
+    "Exif": {
+        piexif.ExifIFD.DateTimeOriginal: b"2015:06:01 10:20:30",
+        piexif.ExifIFD.DateTimeDigitized: b"2015:06:01 10:20:31",
+    },
+    "GPS": {
+        piexif.GPSIFD.GPSDateStamp: b"2015:06:01",
+        piexif.GPSIFD.GPSTimeStamp: ((13, 1), (20, 1), (30, 1)),
+    },
+}
+
+
+def make_image(path, exif_dict=None, fmt="jpeg", color=(120, 30, 200), mtime=1500000000):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    kwargs = {"exif": piexif.dump(exif_dict)} if exif_dict is not None else {}
+    Image.new("RGB", (64, 48), color).save(path, fmt, **kwargs)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def make_tree(root, copies=1):
+    """A few photos covering the ways a date is written: patched, spliced, added."""
+    root = Path(root)
+    for i in range(copies):
+        top = root.joinpath("{:02d}".format(i)) if copies > 1 else root
+        make_image(top / "2014-05-02 Trip" / "a.jpg", FULL_EXIF)
+        make_image(
+            top / "2014-05-02 Trip" / "sub" / "b.jpg",
+            {"0th": {piexif.ImageIFD.DateTime: b"2016:01:02 03:04:05"}},
+        )
+        make_image(
+            top / "2012 Old" / "c.jpg",
+            {"Exif": {piexif.ExifIFD.DateTimeOriginal: b"2012:01:01 08:00:00"}},
+        )
+        make_image(top / "noexif" / "d.jpg")
+        make_image(top / "x" / "e.JPEG", {"0th": {piexif.ImageIFD.DateTime: b"garbage"}})
+    return root
+
+
+def snapshot(root, times=True):
+    """{relative path: (md5, mtime_ns)} of the files under ``root``."""
+    root = Path(root)
+    files = {}
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = Path(directory, name)
+            digest = hashlib.md5(path.read_bytes()).hexdigest()
+            files[path.relative_to(root).as_posix()] = (
+                (digest, path.stat().st_mtime_ns) if times else digest
+            )
+    return files
+
+
+def python_command(code, *args):
+    return [sys.executable, "-c", code] + [str(a) for a in args]
+
+
+def python_env():
+    return dict(os.environ, PYTHONPATH=str(ROOT))
+
+
+def run_python(code, *args, **kwargs):
+    return subprocess.run(python_command(code, *args), env=python_env(), **kwargs)
+
+
+def spawn_python(code, *args, **kwargs):
+    return subprocess.Popen(python_command(code, *args), env=python_env(), **kwargs)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from imagefix.imagefix import ImageDateChooser, ImgObject
+from imagefix.record import from_timestamp, to_timestamp
+
+np = pytest.importorskip("numpy")
+batch = pytest.importorskip("imagefix.batch")
+
+MIN_DATE = datetime(2000, 1, 1)
+MAX_DATE = datetime(2020, 1, 1)
+ONE_US = timedelta(microseconds=1)
+ORDER = ImageDateChooser.CHOOSE_ORDER
+
+
+def random_date(rng):
+    roll = rng.random()
+    if roll < 0.3:
+        return None
+    if roll < 0.45:
+        bound = rng.choice((MIN_DATE, MAX_DATE))
+        return bound + rng.choice((-ONE_US, timedelta(0), ONE_US))
+    day = datetime(1990, 1, 1) + timedelta(days=rng.randrange(40 * 366))
+    if roll < 0.6:
+        # midnight only, a date without time
+        return day
+    if roll < 0.7:
+        # seconds alone are not a time either
+        return day + timedelta(seconds=rng.randrange(60))
+    return day + timedelta(seconds=rng.randrange(86400), microseconds=rng.randrange(1000000))
+
+
+def choose_rows(chooser, rows):
+    expected = []
+    for dates in rows:
+        img_obj = ImgObject("x.jpg", dates=dict(dates))
+        expected.append((chooser.choose(img_obj), img_obj.choosen_key))
+    chosen, source = chooser.choose_batch(batch.dates_to_columns(rows, ORDER))
+    got = [(date.item(), ORDER[i] if i >= 0 else None) for date, i in zip(chosen, source.tolist())]
+    return expected, got
+
+
+def test_batch_chooser_agrees_with_choose():
+    rng = random.Random(11)
+    chooser = ImageDateChooser(min_date=MIN_DATE, max_date=MAX_DATE)
+    rows = [
+        {key: date for key in ORDER for date in [random_date(rng)] if date is not None}
+        for _ in range(20000)
+    ]
+    expected, got = choose_rows(chooser, rows)
+    assert got == expected
+    # every rule was exercised
+    keys = {key for _, key in expected}
+    assert None in keys and len(keys) == len(ORDER) + 1
+
+
+@pytest.mark.parametrize(
+    "dates, key",
+    [
+        ({}, None),
+        ({"File": MIN_DATE}, None),
+        ({"File": MAX_DATE}, None),
+        ({"File": MIN_DATE + ONE_US}, "File"),
+        ({"File": MAX_DATE - ONE_US}, "File"),
+        # the only valid date is taken even at midnight
+        ({"Path": datetime(2010, 5, 1), "File": MAX_DATE}, "Path"),
+        ({"Path": datetime(2010, 5, 1), "DateTime": datetime(2011, 5, 1)}, None),
+        ({"DateTime": datetime(2011, 5, 1, 0, 0, 59), "Path": datetime(2010, 5, 1)}, None),
+        ({"DateTime": datetime(2011, 5, 1, 0, 1), "Path": datetime(2010, 5, 1)}, "DateTime"),
+        ({"GPSDateTime": datetime(2011, 5, 1), "File": datetime(2010, 5, 1, 9)}, "File"),
+    ],
+)
+def test_batch_chooser_rules(dates, key):
+    chooser = ImageDateChooser(min_date=MIN_DATE, max_date=MAX_DATE)
+    expected, got = choose_rows(chooser, [dates])
+    assert got == expected
+    assert got[0][1] == key
+
+
+def test_timestamps_to_column_matches_from_timestamp():
+    rng = random.Random(3)
+    dates = [random_date(rng) for _ in range(5000)]
+    column = batch.timestamps_to_column([to_timestamp(date) for date in dates])
+    assert column.tolist() == [
+        from_timestamp(to_timestamp(date)) if date else None for date in dates
+    ]
+    assert np.isnat(column[[date is None for date in dates]]).all()
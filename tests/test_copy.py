@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+
+import pytest
+
+from imagefix import clone
+from imagefix.imagefix import ImageProcessor, main
+
+from .helpers import make_image, make_tree, snapshot
+
+# before the oldest valid date, in a folder without one
+UNDATED = 900000000
+
+
+def test_same_directory_spelled_another_way_is_fixed_in_place(tmp_path, monkeypatch):
+    original = make_tree(tmp_path / "original")
+    expected = shutil.copytree(original, tmp_path / "expected")
+    assert main([str(expected), "--no-manifest"]) == 0
+    shutil.copytree(original, tmp_path / "photos")
+
+    monkeypatch.chdir(tmp_path)
+    assert main(["photos", "-d", str(tmp_path / "photos"), "--no-manifest"]) == 0
+    assert snapshot(tmp_path / "photos") == snapshot(expected)
+
+
+def test_clone_refuses_to_copy_a_file_over_itself(tmp_path):
+    path = make_image(tmp_path / "a.jpg")
+    data = path.read_bytes()
+    with pytest.raises(shutil.SameFileError):
+        clone.clone_file(path, tmp_path / "." / "a.jpg")
+    assert path.read_bytes() == data
+
+
+def test_dest_dir_inside_main_dir_is_rejected(tmp_path, capsys):
+    root = make_tree(tmp_path / "photos")
+    before = snapshot(root)
+    with pytest.raises(SystemExit):
+        main([str(root), "-d", str(root / "out"), "--no-manifest"])
+    assert "inside" in capsys.readouterr().err
+    with pytest.raises(ValueError):
+        ImageProcessor(root, dest_dir=root / "out").run()
+    assert snapshot(root) == before
+
+
+def test_files_without_a_date_are_cloned(tmp_path):
+    root = make_tree(tmp_path / "photos")
+    make_image(root / "misc" / "old.jpg", mtime=UNDATED)
+    (root / "misc" / "broken.jpg").write_bytes(b"\xff\xd8 not a jpeg")
+    os.utime(root / "misc" / "broken.jpg", (UNDATED, UNDATED))
+    before = snapshot(root)
+    dest = tmp_path / "copy"
+
+    assert main([str(root), "-d", str(dest), "--no-manifest"]) == 1
+    # only the list of failed files was added
+    after = snapshot(root)
+    assert after.pop(".imagefix.quarantine.jsonl")
+    assert after == before
+    copies = snapshot(dest)
+    assert sorted(copies) == sorted(before)
+    # neither could be dated, both are plain clones
+    for name in ("misc/old.jpg", "misc/broken.jpg"):
+        assert copies[name] == before[name]
+    assert copies["2014-05-02 Trip/a.jpg"] != before["2014-05-02 Trip/a.jpg"]
+
+
+class WriteOnlySaver:
+    # the saver interface before the copy mode
+    def __init__(self):
+        self.written = []
+
+    def write(self, img_obj):
+        self.written.append(img_obj.file_obj.name)
+
+
+def test_custom_date_saver_without_copy_mode(tmp_path):
+    root = make_tree(tmp_path / "photos")
+    make_image(root / "misc" / "old.jpg", mtime=UNDATED)
+    saver = WriteOnlySaver()
+    processor = ImageProcessor(root, date_saver=saver)
+    processor.run()
+    assert processor.failed == 0
+    assert sorted(saver.written) == ["a.jpg", "b.jpg", "c.jpg", "d.jpg", "e.JPEG"]
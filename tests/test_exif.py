@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from pathlib import Path
+
+import piexif
+from PIL import Image
+
+from imagefix import exif
+from imagefix.imagefix import ImageProcessor
+
+from .helpers import FULL_EXIF, make_image
+
+NEW_DATE = b"2019:03:04 05:06:07"
+DATE_VALUES = {
+    ("0th", exif.DATE_TIME): NEW_DATE,
+    ("Exif", exif.DATE_TIME_ORIGINAL): NEW_DATE,
+    ("Exif", exif.DATE_TIME_DIGITIZED): NEW_DATE,
+}
+
+
+def pixels(path):
+    with Image.open(path) as img:
+        return img.tobytes()
+
+
+def test_existing_tags_are_patched_in_place(tmp_path):
+    path = make_image(tmp_path / "a.jpg", FULL_EXIF)
+    before = path.read_bytes()
+    assert exif.write_tags(path, DATE_VALUES) == "patched"
+    after = path.read_bytes()
+    assert len(after) == len(before)
+    # only the three date values changed
+    changed = [i for i, (a, b) in enumerate(zip(before, after)) if a != b]
+    assert 0 < len(changed) <= 3 * len(NEW_DATE)
+    loaded = piexif.load(str(path))
+    assert loaded["0th"][piexif.ImageIFD.DateTime] == NEW_DATE
+    assert loaded["Exif"][piexif.ExifIFD.DateTimeOriginal] == NEW_DATE
+    assert loaded["GPS"] == FULL_EXIF["GPS"]
+    assert pixels(path) == pixels(make_image(tmp_path / "ref.jpg", FULL_EXIF))
+
+
+def test_same_values_leave_the_file_unchanged(tmp_path):
+    path = make_image(tmp_path / "a.jpg", FULL_EXIF)
+    before = path.read_bytes()
+    values = {("0th", exif.DATE_TIME): b"2015:06:01 10:20:30"}
+    assert exif.write_tags(path, values) == "unchanged"
+    assert path.read_bytes() == before
+
+
+def test_missing_tags_splice_a_new_app1(tmp_path):
+    path = make_image(tmp_path / "b.jpg", {"0th": {piexif.ImageIFD.DateTime: b"2016"}})
+    before = pixels(path)
+    assert exif.write_tags(path, DATE_VALUES) == "spliced"
+    loaded = piexif.load(str(path))
+    assert loaded["0th"][piexif.ImageIFD.DateTime] == NEW_DATE
+    assert loaded["Exif"][piexif.ExifIFD.DateTimeOriginal] == NEW_DATE
+    assert loaded["Exif"][piexif.ExifIFD.DateTimeDigitized] == NEW_DATE
+    assert pixels(path) == before
+    assert not [p for p in tmp_path.iterdir() if p.name.endswith(".tmp")]
+
+
+def test_jpeg_without_app1_gets_one(tmp_path):
+    path = make_image(tmp_path / "d.jpg")
+    assert exif.read_exif(path) is None
+    before = pixels(path)
+    assert exif.write_tags(path, DATE_VALUES) == "spliced"
+    assert exif.read_exif(path)["0th"][exif.DATE_TIME] == NEW_DATE
+    assert piexif.load(str(path))["Exif"][piexif.ExifIFD.DateTimeOriginal] == NEW_DATE
+    assert pixels(path) == before
+
+
+def test_patch_bytes_matches_write_tags(tmp_path):
+    for name, exif_dict in (("a.jpg", FULL_EXIF), ("d.jpg", None)):
+        path = make_image(tmp_path / name, exif_dict)
+        data = path.read_bytes()
+        result, new_data = exif.patch_bytes(data, DATE_VALUES)
+        assert path.read_bytes() == data
+        assert result == exif.write_tags(path, DATE_VALUES)
+        assert new_data == path.read_bytes()
+
+
+def test_backup_keeps_the_original_dates_in_user_comment(tmp_path):
+    path = make_image(tmp_path / "2014-05-02 Trip" / "c.jpg", FULL_EXIF)
+    before = pixels(path)
+    processor = ImageProcessor(Path(tmp_path), make_backup=True)
+    processor.run()
+    assert processor.failed == 0
+    loaded = piexif.load(str(path))
+    comment = loaded["Exif"][piexif.ExifIFD.UserComment]
+    assert comment.startswith(exif.ASCII_COMMENT)
+    assert b"DateTimeOriginal=2015:06:01 10:20:30" in comment
+    # the GPS date has the time, it is written to the other tags
+    assert loaded["0th"][piexif.ImageIFD.DateTime] == b"2015:06:01 13:20:30"
+    assert pixels(path) == before
+    assert datetime.fromtimestamp(path.stat().st_mtime) == datetime(2015, 6, 1, 13, 20, 30)
+
+
+def test_backup_never_overwrites_an_existing_comment(tmp_path):
+    exif_dict = dict(FULL_EXIF, Exif=dict(FULL_EXIF["Exif"]))
+    exif_dict["Exif"][piexif.ExifIFD.UserComment] = exif.ASCII_COMMENT + b"DateTime=2001:01:01"
+    path = make_image(tmp_path / "a.jpg", exif_dict)
+    ImageProcessor(Path(tmp_path), make_backup=True).run()
+    comment = piexif.load(str(path))["Exif"][piexif.ExifIFD.UserComment]
+    assert comment == exif.ASCII_COMMENT + b"DateTime=2001:01:01"
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import errno
+import json
+import os
+import time
+
+import pytest
+
+from imagefix import failures
+from imagefix.imagefix import ImageProcessor, main
+from imagefix.stats import Stats
+
+from .helpers import make_tree, snapshot
+
+QUARANTINE = failures.Quarantine.STEM + failures.Quarantine.SUFFIX
+
+
+@pytest.fixture
+def faults(monkeypatch):
+    """{file name: I/O errors left to raise} for ImageProcessor.process, and the backoff sleeps."""
+    left = {}
+    sleeps = []
+    process = ImageProcessor.process
+
+    def faulty_process(self, file_obj, header=None):
+        name = os.path.basename(os.fspath(file_obj))
+        if left.get(name):
+            left[name] -= 1
+            raise OSError(errno.EIO, "Input/output error")
+        return process(self, file_obj, header=header)
+
+    monkeypatch.setattr(ImageProcessor, "process", faulty_process)
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    return left, sleeps
+
+
+def test_transient_error_is_retried(tmp_path, faults):
+    left, sleeps = faults
+    root = make_tree(tmp_path / "root")
+    left["a.jpg"] = 2
+    processor = ImageProcessor(root, stats=Stats())
+    processor.run()
+    assert (processor.processed, processor.failed) == (5, 0)
+    assert processor.stats.counters["retry"] == 2
+    # waiting twice as long each time
+    assert sleeps == [0.5, 1.0]
+
+
+def test_retries_are_bounded(tmp_path, faults):
+    left, sleeps = faults
+    root = make_tree(tmp_path / "root")
+    left["a.jpg"] = 10
+    processor = ImageProcessor(root, retries=3, retry_delay=0.1)
+    processor.run()
+    assert (processor.processed, processor.failed) == (4, 1)
+    ((file_obj, failure),) = processor.errors
+    assert os.path.basename(os.fspath(file_obj)) == "a.jpg"
+    assert (failure.category, failure.attempts) == (failures.IO_ERROR, 4)
+    assert sleeps == pytest.approx([0.1, 0.2, 0.4])
+    assert left["a.jpg"] == 6
+
+
+def test_other_errors_are_not_retried(tmp_path, faults):
+    _, sleeps = faults
+    root = make_tree(tmp_path / "root")
+    (root / "bad.jpg").write_bytes(b"\xff\xd8 not a jpeg")
+    processor = ImageProcessor(root)
+    processor.run()
+    ((_, failure),) = processor.errors
+    assert (failure.category, failure.attempts) == (failures.CORRUPT_IFD, 1)
+    assert sleeps == []
+
+
+def test_quarantine_and_retry_failed(tmp_path, faults, capsys):
+    left, _ = faults
+    root = make_tree(tmp_path / "root")
+    left["a.jpg"] = left["c.jpg"] = 10
+    report = tmp_path / "run.jsonl"
+    args = [str(root), "--no-manifest", "-r", str(report)]
+    assert main(args) == 1
+    assert "2 files failed" in capsys.readouterr().out
+    # listed next to the report
+    quarantine = tmp_path / ("run" + failures.Quarantine.SUFFIX)
+    with open(quarantine, encoding="utf-8") as f:
+        listed = [json.loads(line) for line in f]
+    assert sorted(os.path.basename(item["file_path"]) for item in listed) == ["a.jpg", "c.jpg"]
+    assert {(item["category"], item["attempts"]) for item in listed} == {(failures.IO_ERROR, 3)}
+
+    # the share answers again, only the listed files are processed
+    left.clear()
+    before = snapshot(root)
+    assert main(args + ["--retry-failed"]) == 0
+    with open(report, encoding="utf-8") as f:
+        retried = sorted(os.path.basename(json.loads(line)["file_path"]) for line in f)
+    assert retried == ["a.jpg", "c.jpg"]
+    after = snapshot(root)
+    changed = sorted(path for path in after if after[path] != before[path])
+    assert changed == ["2012 Old/c.jpg", "2014-05-02 Trip/a.jpg"]
+    # nothing failed this time, the list is gone
+    assert not quarantine.exists()
+
+
+def test_walker_failures_in_a_parallel_run(tmp_path, monkeypatch):
+    root = make_tree(tmp_path / "root", copies=4)
+    broken = os.path.join(str(root), "02")
+    scandir = os.scandir
+
+    def faulty_scandir(path):
+        if os.fspath(path) == broken:
+            raise OSError(errno.EIO, "Input/output error", broken)
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", faulty_scandir)
+    quarantine = failures.Quarantine(tmp_path / QUARANTINE)
+    processor = ImageProcessor(root, workers=2, quarantine=quarantine, stats=Stats())
+    processor.run()
+    assert (processor.processed, processor.failed) == (15, 1)
+    assert [os.fspath(file_obj) for file_obj, _ in processor.errors] == [broken]
+    assert processor.stats.counters["failed." + failures.IO_ERROR] == 1
+    assert failures.read_quarantine(tmp_path / QUARANTINE) == [broken]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from imagefix.imagefix import ImageDateChooser, ImageProcessor, main
+from imagefix.index import DateIndex
+from imagefix.manifest import RunManifest
+
+from .helpers import make_image, make_tree
+
+
+def test_index_asked_for_on_a_processed_tree(tmp_path):
+    root = make_tree(tmp_path / "photos")
+    index_path = root / DateIndex.FILENAME
+    assert main([str(root)]) == 0
+    # the manifest alone would skip every file
+    assert main([str(root), "--index"]) == 0
+    index = DateIndex(index_path)
+    try:
+        assert index.count() == 5
+        counts, _ = index.rechoose(ImageDateChooser())
+        assert sum(counts.values()) == 5
+    finally:
+        index.close()
+
+    # indexed and unchanged, nothing left to do
+    make_image(root / "new" / "f.jpg")
+    processor = ImageProcessor(
+        root, manifest=RunManifest(root / RunManifest.FILENAME), index=DateIndex(index_path)
+    )
+    processor.run()
+    assert (processor.processed, processor.skipped) == (1, 5)
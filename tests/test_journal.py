@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+
+from imagefix import journal
+from imagefix.imagefix import main
+
+from .helpers import make_image, make_tree, run_python, snapshot
+
+# a run killed at the n-th call of journal.<name>, without any cleanup
+KILLED_RUN = """
+import os, sys
+from imagefix import journal
+from imagefix.imagefix import main
+
+name, n = sys.argv[2], int(sys.argv[3])
+calls = [0]
+original = getattr(journal.WriteJournal if name == "add" else journal, name)
+
+def killed(*args, **kwargs):
+    calls[0] += 1
+    if calls[0] == n:
+        os._exit(9)
+    return original(*args, **kwargs)
+
+if name == "add":
+    journal.WriteJournal.add = killed
+else:
+    setattr(journal, name, killed)
+main([sys.argv[1], "--no-manifest", "--write-batch", "4"] + sys.argv[4:])
+"""
+
+
+def kill_run(root, name, n, *args):
+    result = run_python(KILLED_RUN, root, name, n, *args)
+    assert result.returncode == 9
+
+
+def temp_files(root):
+    return [path for path in snapshot(root) if path.endswith(".tmp")]
+
+
+def journal_dir(root):
+    return root / journal.WriteJournal.DIRNAME
+
+
+def test_resume_finishes_a_run_killed_mid_batch(tmp_path):
+    original = make_tree(tmp_path / "original", copies=3)
+    expected = shutil.copytree(original, tmp_path / "expected")
+    assert main([str(expected), "--no-manifest"]) == 0
+    root = shutil.copytree(original, tmp_path / "root")
+
+    # the first batch is committed, the second one dies before its first write
+    kill_run(root, "redo", 5)
+    assert temp_files(root)
+    assert journal.journal_files(journal_dir(root))
+
+    assert main([str(root), "--no-manifest", "--resume"]) == 0
+    assert snapshot(root) == snapshot(expected)
+    assert not journal_dir(root).exists()
+
+
+def test_rollback_restores_bytes_and_times(tmp_path):
+    original = make_tree(tmp_path / "original", copies=3)
+    root = shutil.copytree(original, tmp_path / "root")
+
+    kill_run(root, "redo", 7)
+    assert snapshot(root) != snapshot(original)
+
+    assert main([str(root), "--rollback"]) is None
+    assert snapshot(root) == snapshot(original)
+    assert not journal_dir(root).exists()
+
+
+def changed_after_crash(root):
+    (log,) = journal.journal_files(journal_dir(root))
+    _, pending = journal.read_batches(log)
+    changed = pending[-1]["path"]
+    # someone saves another picture over it before the recovery
+    make_image(changed, color=(0, 255, 0))
+    return changed, snapshot(root)
+
+
+def test_resume_leaves_files_changed_since_the_crash(tmp_path):
+    root = make_tree(tmp_path / "root", copies=3)
+    kill_run(root, "redo", 5)
+    changed, before = changed_after_crash(root)
+
+    assert journal.recover(journal_dir(root)) == [changed]
+    after = snapshot(root)
+    relative = os.path.relpath(changed, root).replace(os.sep, "/")
+    assert after[relative] == before[relative]
+    assert not temp_files(root)
+
+
+def test_rollback_reports_files_changed_since_the_crash(tmp_path, capsys):
+    root = make_tree(tmp_path / "root", copies=3)
+    kill_run(root, "redo", 5)
+    changed, before = changed_after_crash(root)
+
+    main([str(root), "--rollback"])
+    assert (
+        "Changed since it was journaled, left alone: {}".format(changed) in capsys.readouterr().out
+    )
+    relative = os.path.relpath(changed, root).replace(os.sep, "/")
+    assert snapshot(root)[relative] == before[relative]
+    assert not temp_files(root)
+
+
+def test_run_killed_while_planning_leaves_no_copies(tmp_path):
+    original = make_tree(tmp_path / "original", copies=3)
+    root = shutil.copytree(original, tmp_path / "root")
+
+    # the copies of a splice are only made once the batch is logged
+    kill_run(root, "add", 10, "--write-batch", "256", "-b")
+    assert not temp_files(root)
+    assert snapshot(root) == snapshot(original)
+
+    assert main([str(root), "--rollback"]) is None
+    assert snapshot(root) == snapshot(original)
+
+
+def test_recover_removes_every_copy_the_journal_lists(tmp_path):
+    root = make_tree(tmp_path / "root", copies=3)
+    kill_run(root, "redo", 5)
+    (log,) = journal.journal_files(journal_dir(root))
+    committed, pending = journal.read_batches(log)
+    listed = [entry["tmp"] for entry in committed + pending if entry["op"] == "splice"]
+    assert len(listed) > len(temp_files(root))
+    for tmp_name in listed:
+        # incomplete copies, as left by a redo or a rollback killed in turn
+        with open(tmp_name, "wb") as f:
+            f.write(b"\xff\xd8")
+
+    assert main([str(root), "--no-manifest", "--resume"]) == 0
+    assert not temp_files(root)
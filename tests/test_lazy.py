@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import shutil
+from datetime import datetime
+
+import piexif
+
+from imagefix.imagefix import FileEntry, ImageDateChooser, ImageProcessor
+from imagefix.stats import Stats
+
+from .helpers import make_image, make_tree, snapshot
+
+# before the oldest valid date
+UNDATED = 900000000
+
+
+def make_mixed_tree(root):
+    root = make_tree(root, copies=2)
+    # only the folder has a date
+    make_image(root / "2011-03-04 Party" / "f.jpg", mtime=UNDATED)
+    # nothing valid at all
+    make_image(root / "misc" / "g.jpg", mtime=UNDATED)
+    # dates without time, none is taken
+    make_image(
+        root / "2010-01-01" / "h.jpg",
+        {"Exif": {piexif.ExifIFD.DateTimeOriginal: b"2010:01:02 00:00:00"}},
+        mtime=UNDATED,
+    )
+    return root
+
+
+def choices(processor, root):
+    outcomes = []
+    for entry in sorted(processor.iter_files(root), key=lambda entry: entry.path):
+        img_obj = processor.process(entry)
+        outcomes.append((entry.path, img_obj.choosen, img_obj.choosen_key, img_obj.reason))
+    return outcomes
+
+
+def test_lazy_choice_is_the_eager_one(tmp_path):
+    root = make_mixed_tree(tmp_path / "root")
+    lazy = ImageProcessor(root, dry_run=True, stats=Stats())
+    eager = ImageProcessor(root, dry_run=True, stats=Stats())
+    eager.all_dates = True
+    assert lazy.chooses_lazily() and not eager.chooses_lazily()
+
+    expected = choices(eager, root)
+    assert choices(lazy, root) == expected
+    reasons = {reason for _, _, _, reason in expected}
+    assert reasons == {
+        "first date with time",
+        "only valid date",
+        "no date with time",
+        "no valid date",
+    }
+
+    # the well tagged files never needed their folder or their file date
+    assert lazy.stats.counters["skipped.path"] > 0
+    assert lazy.stats.counters["skipped.file"] > 0
+    assert not any(name.startswith("skipped.") for name in eager.stats.counters)
+
+
+def test_lazy_run_writes_what_the_eager_one_does(tmp_path):
+    original = make_mixed_tree(tmp_path / "original")
+    eager_root = shutil.copytree(original, tmp_path / "eager")
+    lazy_root = shutil.copytree(original, tmp_path / "lazy")
+    eager = ImageProcessor(eager_root)
+    eager.all_dates = True
+    eager.run()
+    ImageProcessor(lazy_root).run()
+    assert snapshot(lazy_root) == snapshot(eager_root)
+    assert snapshot(lazy_root) != snapshot(original)
+
+
+class PlainChooser:
+    # the chooser interface before the lazy search
+    def choose(self, img_obj):
+        img_obj.choosen_key = "File" if "File" in img_obj.dates else None
+        return img_obj.dates.get("File")
+
+
+class PlainFinder:
+    def get_dates(self, img_obj):
+        img_obj.dates["File"] = datetime(2012, 3, 4, 5, 6, 7)
+        return img_obj.dates
+
+    def write_dates(self, img_obj):
+        pass
+
+
+class NoonChooser(ImageDateChooser):
+    # overrides choose() only, the inherited choose_lazy would bypass it
+    def choose(self, img_obj):
+        super().choose(img_obj)
+        img_obj.choosen_key = "Noon"
+        return datetime(2013, 1, 1, 12)
+
+
+def test_custom_chooser_and_finder_without_lazy_methods(tmp_path):
+    root = make_tree(tmp_path / "root")
+    entry = next(iter(ImageProcessor(root).iter_files(root)))
+    processor = ImageProcessor(
+        root, dry_run=True, date_chooser=PlainChooser(), date_finder=PlainFinder()
+    )
+    assert not processor.chooses_lazily()
+    img_obj = processor.process(entry)
+    assert img_obj.choosen == datetime(2012, 3, 4, 5, 6, 7)
+
+    processor = ImageProcessor(root, dry_run=True, date_finder=PlainFinder())
+    assert processor.process(FileEntry(entry.path, entry.stat)).choosen_key == "File"
+
+    processor = ImageProcessor(root, dry_run=True)
+    processor.date_chooser = NoonChooser(processor=processor)
+    assert not processor.chooses_lazily()
+    assert processor.process(entry).choosen == datetime(2013, 1, 1, 12)
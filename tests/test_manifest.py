@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import shutil
+from pathlib import Path
+
+from imagefix.imagefix import ImageProcessor
+from imagefix.manifest import RunManifest
+from imagefix.merge import merge_manifests
+
+from .helpers import make_tree
+
+
+def run(main_dir, manifest_path, **kwargs):
+    processor = ImageProcessor(Path(main_dir), manifest=RunManifest(manifest_path), **kwargs)
+    processor.run()
+    return processor
+
+
+def test_unchanged_files_are_skipped_however_main_dir_is_spelled(tmp_path, monkeypatch):
+    root = make_tree(tmp_path / "photos")
+    manifest = tmp_path / "photos" / RunManifest.FILENAME
+    monkeypatch.chdir(tmp_path)
+
+    assert run("photos", manifest).processed == 5
+    for main_dir in (root, "photos", tmp_path / "." / "photos", "photos/"):
+        processor = run(main_dir, manifest)
+        assert (processor.processed, processor.skipped) == (0, 5)
+    # the same folder as dest_dir is not a copy
+    processor = run("photos", manifest, dest_dir=root)
+    assert (processor.processed, processor.skipped) == (0, 5)
+
+
+def test_copies_elsewhere_are_another_configuration(tmp_path):
+    root = make_tree(tmp_path / "photos")
+    manifest = tmp_path / "photos" / RunManifest.FILENAME
+    run(root, manifest)
+    processor = run(root, manifest, dest_dir=tmp_path / "copy")
+    assert (processor.processed, processor.skipped) == (5, 0)
+
+
+def test_manifests_of_hosts_mounting_the_tree_elsewhere_merge(tmp_path):
+    one = make_tree(tmp_path / "host1" / "photos")
+    two = shutil.copytree(one, tmp_path / "host2" / "mnt" / "photos")
+    run(one, tmp_path / "one.db", shard=(0, 2))
+    run(two, tmp_path / "two.db", shard=(1, 2))
+    assert merge_manifests(tmp_path / "merged.db", [tmp_path / "one.db", tmp_path / "two.db"]) == 5
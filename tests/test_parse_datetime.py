@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from imagefix import exif
+
+ALPHABET = "0123456789" * 4 + ":/\\- " + "T.+aZ\x00٣é"
+SEPARATORS = ":/\\- "
+
+# the usual ranges of year, month, day, hour, minute and second
+RANGES = ((1, 9999), (1, 12), (1, 31), (0, 23), (0, 59), (0, 59))
+
+
+def field(rng, low, high):
+    # mostly in range, sometimes out of it or not the usual width
+    width = 4 if high == 9999 else 2
+    roll = rng.random()
+    if roll < 0.9:
+        return str(rng.randint(low, high)).zfill(width)
+    if roll < 0.95:
+        return str(rng.randint(0, 10 ** (width + 1)))
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, width + 1)))
+
+
+def datetime_like(rng):
+    fields = [field(rng, low, high) for low, high in RANGES]
+    date_sep = rng.choice(SEPARATORS) if rng.random() < 0.2 else ":"
+    value = date_sep.join(fields[:3])
+    if rng.random() < 0.8:
+        value += " " + ":".join(fields[3:])
+    return value
+
+
+def mutated(rng, value):
+    chars = list(value)
+    for _ in range(rng.randint(1, 3)):
+        position = rng.randint(0, len(chars))
+        roll = rng.random()
+        if roll < 0.4 and chars:
+            del chars[min(position, len(chars) - 1)]
+        elif roll < 0.7:
+            chars.insert(position, rng.choice(ALPHABET))
+        elif chars:
+            chars[min(position, len(chars) - 1)] = rng.choice(ALPHABET)
+    return "".join(chars)
+
+
+def values(rng, count):
+    for i in range(count):
+        value = datetime_like(rng)
+        if i % 3 == 1:
+            value = mutated(rng, value)
+        elif i % 3 == 2:
+            value = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 22)))
+        yield value
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "2015:06:01 10:20:30",
+        "2015:06:01",
+        "2015/06/01 10:20:30",
+        "2015:6:1 10:20:30",
+        "0000:00:00 00:00:00",
+        "2015:02:29 10:20:30",
+        "2016:02:29 24:00:00",
+        "    :  :     :  :  ",
+        "2015:06:01 10:20:30\x00",
+        "",
+    ],
+)
+def test_known_values_agree_with_strptime(value):
+    assert exif.parse_datetime(value) == exif._parse_datetime_slow(value)
+    assert exif.parse_datetime(value.encode("utf-8")) == exif._parse_datetime_slow(value)
+
+
+def test_fast_path_agrees_with_strptime():
+    parse = exif.parse_datetime.__wrapped__
+    rng = random.Random(12)
+    parsed = 0
+    for value in values(rng, 100000):
+        expected = exif._parse_datetime_slow(value)
+        assert parse(value) == expected, value
+        assert parse(value.encode("utf-8")) == expected, value
+        parsed += expected is not None
+    # enough of them are dates for the fast path to be exercised
+    assert parsed > 10000
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+from imagefix.imagefix import ImageProcessor
+from imagefix.manifest import RunManifest
+
+from .helpers import make_image, make_tree, snapshot
+
+
+class SlowDisk:
+    """Makes the header reads and the stats of the prefetch threads take ``latency``
+    seconds, and counts the most of them in flight at once."""
+
+    def __init__(self, latency=0.02):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.in_flight = {"read": 0, "stat": 0}
+        self.most = {"read": 0, "stat": 0}
+        self.calls = {"read": 0, "stat": 0}
+
+    def slow(self, kind, function):
+        def slow_function(*args, **kwargs):
+            if not threading.current_thread().name.startswith("prefetch"):
+                return function(*args, **kwargs)
+            with self.lock:
+                self.in_flight[kind] += 1
+                self.calls[kind] += 1
+                self.most[kind] = max(self.most[kind], self.in_flight[kind])
+            try:
+                time.sleep(self.latency)
+                return function(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.in_flight[kind] -= 1
+
+        return slow_function
+
+
+def run(root, monkeypatch, **kwargs):
+    disk = SlowDisk()
+    processor = ImageProcessor(root, **kwargs)
+    processor.read_header = disk.slow("read", processor.read_header)
+    with monkeypatch.context() as patch:
+        patch.setattr(os, "stat", disk.slow("stat", os.stat))
+        patch.setattr(os, "fstat", disk.slow("stat", os.fstat))
+        processor.run()
+    assert processor.failed == 0
+    return processor, disk
+
+
+@pytest.fixture
+def trees(tmp_path, monkeypatch):
+    original = make_tree(tmp_path / "original", copies=8)
+    expected = shutil.copytree(original, tmp_path / "expected")
+    run(expected, monkeypatch)
+    return original, snapshot(expected)
+
+
+@pytest.mark.parametrize(
+    "kwargs, most",
+    [
+        ({"prefetch": 4}, 4),
+        ({"prefetch": 1}, 1),
+        # the memory cap allows two headers only
+        ({"prefetch": 8, "prefetch_memory": 2 * 65536}, 2),
+        ({"prefetch": 8, "prefetch_bytes": 4096, "prefetch_memory": 3 * 4096}, 3),
+        # headers too short for the EXIF block are read again
+        ({"prefetch": 4, "prefetch_bytes": 64}, 4),
+    ],
+)
+def test_prefetch_keeps_n_reads_in_flight(tmp_path, monkeypatch, trees, kwargs, most):
+    original, expected = trees
+    root = shutil.copytree(original, tmp_path / "root")
+    _, disk = run(root, monkeypatch, **kwargs)
+    assert disk.calls == {"read": 40, "stat": 40}
+    # the stats are made ahead like the reads, not one after the other by the walker
+    assert disk.most == {"read": most, "stat": most}
+    assert snapshot(root) == expected
+
+
+def test_prefetch_checks_the_manifest_ahead(tmp_path, monkeypatch):
+    root = make_tree(tmp_path / "root", copies=8)
+    manifest = root / RunManifest.FILENAME
+    run(root, monkeypatch, manifest=RunManifest(manifest))
+    make_image(root / "new" / "f.jpg")
+
+    processor, disk = run(root, monkeypatch, manifest=RunManifest(manifest), prefetch=4)
+    assert (processor.processed, processor.skipped) == (1, 40)
+    # the unchanged files are never opened
+    assert disk.calls == {"read": 41, "stat": 41}
+    assert disk.most["stat"] == 4
+
+
+def test_no_prefetch_reads_no_header(tmp_path, monkeypatch, trees):
+    original, expected = trees
+    root = shutil.copytree(original, tmp_path / "root")
+    _, disk = run(root, monkeypatch, prefetch=0)
+    assert disk.calls == {"read": 0, "stat": 0}
+    assert snapshot(root) == expected
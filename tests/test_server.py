@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+
+import pytest
+
+from imagefix import failures
+
+from .helpers import FULL_EXIF, make_image, make_tree, snapshot, spawn_python
+
+SERVE = "from imagefix.server import main; main()"
+
+
+def serve(*args):
+    return spawn_python(
+        SERVE, *args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True
+    )
+
+
+def read_replies(proc, timeout=60):
+    # every line until the server exits, killed if it hangs
+    watchdog = threading.Timer(timeout, proc.kill)
+    watchdog.start()
+    try:
+        replies = [json.loads(line) for line in proc.stdout]
+        proc.wait()
+    finally:
+        watchdog.cancel()
+    return replies
+
+
+def send(proc, *messages):
+    for message in messages:
+        line = message if isinstance(message, str) else json.dumps(message)
+        proc.stdin.write(line + "\n")
+    proc.stdin.flush()
+
+
+def by_id(replies, request_id):
+    return [reply for reply in replies if reply.get("id") == request_id]
+
+
+def test_stdin_requests(tmp_path):
+    path = make_image(tmp_path / "2014-05-02 Trip" / "a.jpg", FULL_EXIF)
+    before = snapshot(tmp_path)
+    proc = serve()
+    send(
+        proc,
+        {"id": 1, "op": "ping"},
+        {"id": 2, "path": str(path)},
+        "{not json",
+        "[1, 2]",
+        {"id": 3, "path": str(tmp_path / "missing.jpg")},
+        {"id": 4, "paths": "a.jpg"},
+    )
+    proc.stdin.close()
+    replies = read_replies(proc)
+    assert proc.returncode == 0
+
+    assert by_id(replies, 1) == [{"id": 1, "ok": True}]
+    record, done = by_id(replies, 2)
+    assert record["file_path"] == str(path)
+    assert record["outcome"] == "patched"
+    assert record["choosen"] == "2015-06-01 13:20:30"
+    assert done == {"id": 2, "done": True, "files": 1, "failed": 0}
+    assert snapshot(tmp_path) != before
+
+    invalid = by_id(replies, None)
+    assert len(invalid) == 2
+    assert all(reply["error"].startswith("invalid request: ") for reply in invalid)
+
+    failure, done = by_id(replies, 3)
+    assert failure["category"] == failures.IO_ERROR
+    assert failure["error"].startswith("FileNotFoundError")
+    assert done == {"id": 3, "done": True, "files": 1, "failed": 1}
+    assert by_id(replies, 4) == [{"id": 4, "error": 'expected "path" or a list of "paths"'}]
+
+
+def test_shutdown_answers_the_queued_requests_first(tmp_path):
+    root = make_tree(tmp_path / "root", copies=20)
+    proc = serve("--max-pending", "2")
+    # the first request keeps the worker busy while the others queue up
+    requests = [{"id": 0, "path": str(root)}]
+    requests += [{"id": i, "path": str(root / "00" / "noexif" / "d.jpg")} for i in range(1, 6)]
+    send(proc, *requests)
+    send(proc, {"id": "stop", "op": "shutdown"})
+    # the input stays open, the shutdown request alone stops the server
+    replies = read_replies(proc)
+    proc.stdin.close()
+    assert proc.returncode == 0
+
+    done = [reply for reply in replies if reply.get("done")]
+    assert [reply["id"] for reply in done] == list(range(6))
+    assert done[0]["files"] == 100 and done[0]["failed"] == 0
+    assert replies[-1] == {"id": "stop", "ok": True}
+
+
+def connect(path, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(path)
+            return conn
+        except OSError:
+            conn.close()
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def read_lines(reader):
+    return [json.loads(line) for line in reader]
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="no Unix domain sockets")
+def test_socket_requests(tmp_path):
+    path = make_image(tmp_path / "2014-05-02 Trip" / "a.jpg", FULL_EXIF)
+    address = os.path.join(str(tmp_path), "s")
+    proc = spawn_python(SERVE, "--socket", address, "--max-clients", "1")
+    try:
+        first = connect(address)
+        first.settimeout(30)
+        reader = first.makefile("r", encoding="utf-8")
+        first.sendall(b'{"id": 1, "op": "ping"}\n')
+        assert json.loads(reader.readline()) == {"id": 1, "ok": True}
+
+        # the only client slot is taken
+        second = connect(address)
+        second.settimeout(30)
+        assert read_lines(second.makefile("r", encoding="utf-8")) == [
+            {"id": None, "error": "too many clients, at most 1"}
+        ]
+        second.close()
+
+        first.sendall(json.dumps({"id": 2, "path": str(path)}).encode("utf-8") + b"\n")
+        first.sendall(b"oops\n")
+        first.shutdown(socket.SHUT_WR)
+        replies = read_lines(reader)
+        reader.close()
+        first.close()
+        assert replies[0]["id"] == 2 and replies[0]["outcome"] == "patched"
+        assert replies[1] == {"id": 2, "done": True, "files": 1, "failed": 0}
+        assert replies[2]["id"] is None and replies[2]["error"].startswith("invalid request")
+
+        # the slot is free again once the first client is gone, which may take a moment
+        while True:
+            third = connect(address)
+            third.settimeout(30)
+            try:
+                third.sendall(b'{"id": 3, "op": "shutdown"}\n')
+                third.shutdown(socket.SHUT_WR)
+                replies = read_lines(third.makefile("r", encoding="utf-8"))
+            except ConnectionResetError:
+                # refused before its request was read
+                continue
+            finally:
+                third.close()
+            if replies[0]["id"] is not None:
+                break
+        assert replies == [{"id": 3, "ok": True}]
+        assert proc.wait(30) == 0
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    assert not os.path.exists(address)
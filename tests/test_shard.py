@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import json
+import shutil
+import sqlite3
+
+from imagefix.manifest import RunManifest
+
+from .helpers import make_tree, run_python, snapshot, spawn_python
+
+RUN = "import sys; from imagefix.imagefix import main; sys.exit(main(sys.argv[1:]))"
+MERGE = "from imagefix.merge import main; main()"
+SHARDS = 3
+
+
+def images(root):
+    return {path: value for path, value in snapshot(root).items() if ".imagefix" not in path}
+
+
+def records(path, root):
+    # the records of both runs, as if they were made in the same directory
+    with open(path, encoding="utf-8") as f:
+        return sorted(line.replace('"{}/'.format(root), '"ROOT/') for line in f)
+
+
+def manifest_rows(path, root):
+    conn = sqlite3.connect(str(path))
+    try:
+        rows = conn.execute("SELECT path, size, mtime_ns, choosen, outcome FROM files").fetchall()
+    finally:
+        conn.close()
+    return sorted((path.replace(root, "ROOT", 1),) + tuple(rest) for path, *rest in rows)
+
+
+def test_shards_cover_the_tree_once_and_merge_like_one_run(tmp_path):
+    original = make_tree(tmp_path / "original", copies=8)
+    shutil.copytree(original, tmp_path / "single")
+    shutil.copytree(original, tmp_path / "sharded")
+
+    single = run_python(RUN, "single", "-r", "single.jsonl", cwd=tmp_path)
+    assert single.returncode == 0
+    shards = [
+        spawn_python(
+            RUN,
+            "sharded",
+            "--shard",
+            "{}/{}".format(i, SHARDS),
+            "-r",
+            "shard{}.jsonl".format(i),
+            cwd=tmp_path,
+        )
+        for i in range(1, SHARDS + 1)
+    ]
+    assert [shard.wait(60) for shard in shards] == [0] * SHARDS
+
+    # every file in exactly one shard
+    covered = []
+    for i in range(1, SHARDS + 1):
+        with open(tmp_path / "shard{}.jsonl".format(i), encoding="utf-8") as f:
+            paths = [json.loads(line)["file_path"] for line in f]
+        assert paths
+        covered += paths
+    assert all(covered.count(path) == 1 for path in covered)
+    assert sorted(covered) == sorted("sharded/" + path for path in images(original))
+    assert images(tmp_path / "sharded") == images(tmp_path / "single")
+
+    reports = ["shard{}.jsonl".format(i) for i in range(1, SHARDS + 1)]
+    assert run_python(MERGE, "reports", "merged.jsonl", *reports, cwd=tmp_path).returncode == 0
+    assert records(tmp_path / "merged.jsonl", "sharded") == records(
+        tmp_path / "single.jsonl", "single"
+    )
+
+    manifests = [
+        "sharded/{}-{}-of-{}.db".format(RunManifest.STEM, i, SHARDS) for i in range(1, SHARDS + 1)
+    ]
+    single_rows = manifest_rows(tmp_path / "single" / RunManifest.FILENAME, "single")
+    assert len(single_rows) == len(covered)
+    assert run_python(MERGE, "manifests", "merged.db", *manifests, cwd=tmp_path).returncode == 0
+    assert manifest_rows(tmp_path / "merged.db", "sharded") == single_rows